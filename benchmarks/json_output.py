@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""JSON output benchmark for the teamcity CLI
+
+Times output_json_data on a large payload, shaped like the output of
+`build show details --show-all` for many builds, with syntax highlighting
+(--color) and without it (--no-color, or stdout not a TTY). Also checks
+that pygments isn't imported when not coloring.
+
+    $ python benchmarks/json_output.py --megabytes 10
+"""
+
+import json
+import os
+import sys
+import time
+
+import click
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_dir)
+
+import teamcitycli  # noqa: E402
+from mock_server import make_build  # noqa: E402
+
+
+def make_payload(megabytes):
+    builds = []
+    size = 0
+    while size < megabytes * 1024 * 1024:
+        build = make_build(len(builds) + 1)
+        builds.append(build)
+        size += len(json.dumps(build, indent=4))
+    return {'count': len(builds), 'build': builds}
+
+
+def time_output(data, color):
+    ctx = click.Context(teamcitycli.cli, color=color)
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        with ctx:
+            start = time.time()
+            teamcitycli.output_json_data(data)
+            return time.time() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+@click.command()
+@click.option('--megabytes', default=10.0, help='Size of the JSON payload')
+@click.option('--runs', default=3, help='Number of timed runs')
+def main(megabytes, runs):
+    data = make_payload(megabytes)
+    click.echo('payload: %d builds, %.1f MB' % (
+        data['count'], len(json.dumps(data, indent=4)) / 1024.0 / 1024))
+    click.echo('JSON backend: %s' % (
+        teamcitycli.get_json_backend().__name__))
+
+    plain = min(time_output(data, False) for _ in range(runs))
+    imported = 'pygments' in sys.modules
+    click.echo('%-4s --no-color: %.2f s (pygments imported: %s)' % (
+        'FAIL' if imported else 'ok', plain, imported))
+
+    colored = min(time_output(data, True) for _ in range(runs))
+    click.echo('     --color:    %.2f s (%.1fx slower)' % (
+        colored, colored / plain))
+
+    sys.exit(1 if imported else 0)
+
+
+if __name__ == '__main__':
+    main()
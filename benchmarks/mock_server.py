@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+"""Stand-in TeamCity server for the benchmarks
+
+Answers the REST API requests that the CLI makes, with responses shaped
+like TeamCity's, for as many builds and agents as asked for. Like
+TeamCity, it honors the `fields=` parameter and the `start`/`count` of
+listings, unless --ignore-fields makes it act like an older TeamCity
+that only lists the basic fields of each item. Every response is delayed
+by --latency seconds, builds and agents can be padded out to
+--item-bytes of JSON each, and build logs are made up as they are sent,
+so that a large one doesn't take memory.
+
+    $ python benchmarks/mock_server.py --port 8111 --builds 1000
+    $ TEAMCITY_HOST=localhost TEAMCITY_PORT=8111 teamcity build list
+
+GET /mock/stats gives the number of requests answered so far.
+"""
+
+import json
+import re
+import sys
+import threading
+import time
+
+import click
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs
+
+
+# Every how many agents one is running a build
+running_agent_every = 3
+log_line = '[%s] Step 1/1: Command Line (1s): some output of the build\n'
+# The fields of the items in listings without `fields=`
+short_fields = {
+    'build': 'id,buildTypeId,number,status,state,branchName,defaultBranch,'
+             'href,webUrl',
+    'agent': 'id,name,typeId,href',
+}
+
+
+def make_build(build_id, padding=0):
+    build = {
+        'id': build_id,
+        'number': str(build_id),
+        'status': 'FAILURE' if build_id % 7 == 0 else 'SUCCESS',
+        'state': 'finished',
+        'buildTypeId': 'Project_Build%d' % (build_id % 5),
+        'branchName': 'feature/branch-%d' % build_id,
+        'defaultBranch': build_id % 2 == 0,
+        'href': '/guestAuth/app/rest/builds/id:%d' % build_id,
+        'webUrl': 'https://teamcity.example.com/viewLog.html?buildId=%d'
+                  % build_id,
+        'statusText': 'Tests passed: %d, ignored: 3' % build_id,
+        'buildType': {'id': 'Project_Build%d' % (build_id % 5),
+                      'name': 'Build %d' % (build_id % 5),
+                      'projectId': 'Project', 'projectName': 'Project'},
+        'queuedDate': '20240101T000000+0000',
+        'startDate': '20240101T000010+0000',
+        'finishDate': '20240101T001000+0000',
+        'triggered': {'type': 'user', 'date': '20240101T000000+0000',
+                      'user': {'username': 'user%d' % (build_id % 50)}},
+        'agent': {'id': build_id % 20, 'name': 'agent%d' % (build_id % 20)},
+        'properties': {'property': [
+            {'name': 'env.VAR_%d' % i, 'value': 'value %d' % i}
+            for i in range(20)]},
+    }
+    return pad(build, padding)
+
+
+def make_agent(agent_id, padding=0):
+    agent = {
+        'id': agent_id,
+        'name': 'agent%d' % agent_id,
+        'typeId': agent_id,
+        'connected': True,
+        'enabled': True,
+        'authorized': True,
+        'uptodate': True,
+        'ip': '10.0.%d.%d' % (agent_id // 256, agent_id % 256),
+        'href': '/guestAuth/app/rest/agents/id:%d' % agent_id,
+        'webUrl': 'https://teamcity.example.com/agentDetails.html?id=%d'
+                  % agent_id,
+        'pool': {'id': 0, 'name': 'Default'},
+    }
+    if agent_id % running_agent_every == 0:
+        agent['build'] = {
+            'id': agent_id, 'statusText': 'Step 1/1',
+            'buildType': {'name': 'Build', 'projectName': 'Project'}}
+    return pad(agent, padding)
+
+
+def pad(item, padding):
+    """Add a padding field to item for its JSON to be padding bytes"""
+    size = len(json.dumps(item))
+    if padding > size:
+        item['padding'] = 'x' * max(padding - size - 15, 0)
+    return item
+
+
+def parse_fields(fields):
+    """Parse a `fields=` expression into a dict of name to sub-fields
+
+    For example `count,build(id,agent(name))` gives
+    {'count': None, 'build': {'id': None, 'agent': {'name': None}}}.
+    """
+    result = {}
+    name = ''
+    depth = 0
+    start = None
+    for idx, char in enumerate(fields + ','):
+        if depth == 0 and char == ',':
+            if name:
+                result[name] = None if start is None else \
+                    parse_fields(fields[start:idx - 1])
+            name, start = '', None
+        elif char == '(':
+            depth += 1
+            if depth == 1:
+                start = idx + 1
+        elif char == ')':
+            depth -= 1
+        elif depth == 0:
+            name += char
+    return result
+
+
+def select_fields(data, fields):
+    """Keep only the fields of data, recursively, as TeamCity does"""
+    if fields is None or '$long' in fields or '*' in fields:
+        return data
+    if isinstance(data, list):
+        return [select_fields(item, fields) for item in data]
+    if not isinstance(data, dict):
+        return data
+    return dict((name, select_fields(data[name], sub_fields))
+                for name, sub_fields in fields.items() if name in data)
+
+
+class MockTeamCityHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, body, content_type='application/json', status=200):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, data, status=200):
+        self.send_body(json.dumps(data).encode('utf-8'), status=status)
+
+    def do_GET(self):
+        server = self.server
+        # Not urlparse: pyteamcity asks for e.g. //agentDetails.html?id=1,
+        # which it would take the host of
+        url_path, _, query_string = self.path.partition('?')
+        if url_path == '/mock/stats':
+            return self.send_json({'requests': server.requests})
+        with server.lock:
+            server.requests += 1
+        time.sleep(server.latency)
+
+        query = dict((name, values[0])
+                     for name, values in parse_qs(query_string).items())
+        fields = parse_fields(query['fields']) \
+            if 'fields' in query and not server.ignore_fields else None
+        path = re.sub(r'^/+((guestAuth|httpAuth)/+)?', '/', url_path)
+        match = re.match(r'/app/rest/(builds|agents)/?(?:id:(\d+))?$', path)
+        if match and match.group(2):
+            item_id = int(match.group(2))
+            if match.group(1) == 'builds' and item_id <= server.builds:
+                item = make_build(item_id, server.item_bytes)
+            elif match.group(1) == 'agents' and item_id <= server.agents:
+                item = make_agent(item_id, server.item_bytes)
+            else:
+                return self.send_body(b'Not found', 'text/plain', 404)
+            return self.send_json(select_fields(item, fields))
+        if match and match.group(1) == 'builds':
+            return self.send_builds(query, fields, query_string)
+        if match:
+            agents = [make_agent(agent_id, server.item_bytes)
+                      for agent_id in range(1, server.agents + 1)]
+            return self.send_json(select_fields(
+                {'count': len(agents), 'agent': self.shorten(agents)},
+                fields))
+        if path.endswith('/agentDetails.html'):
+            return self.send_agent_details(int(query['id']))
+        if path.endswith('/downloadBuildLog.html'):
+            return self.send_log()
+        if path == '/app/rest/server':
+            return self.send_json({'version': '2017.1 (build 46533)',
+                                   'versionMajor': 2017, 'versionMinor': 1})
+        self.send_body(b'Not found', 'text/plain', 404)
+
+    def shorten(self, items):
+        """items as listed without `fields=`, if the server ignores it"""
+        if not self.server.ignore_fields or not items:
+            return items
+        item_name = 'build' if 'buildTypeId' in items[0] else 'agent'
+        return select_fields(items, parse_fields(short_fields[item_name]))
+
+    def send_builds(self, query, fields, query_string):
+        server = self.server
+        locator = query.get('locator', '')
+        ids = [int(build_id)
+               for build_id in re.findall(r'item:\(id:(\d+)\)', locator)]
+        start = int(query.get('start', 0))
+        count = int(query.get('count', 100))
+        more = False
+        if not ids:
+            # Newest first, like TeamCity
+            ids = range(server.builds - start,
+                        max(server.builds - start - count, 0), -1)
+            more = start + count < server.builds
+        builds = [make_build(build_id, server.item_bytes)
+                  for build_id in ids if build_id <= server.builds]
+        data = {'count': len(builds), 'build': self.shorten(builds)}
+        if more:
+            rest = re.sub(r'(^|&)start=\d+', '', query_string)
+            data['nextHref'] = '/guestAuth/app/rest/builds/?%s&start=%d' % (
+                rest.lstrip('&'), start + count)
+        self.send_json(select_fields(data, fields))
+
+    def send_agent_details(self, agent_id):
+        if agent_id % running_agent_every:
+            html = '<html><body>Idle</body></html>'
+        else:
+            html = ('<html><body>Running build '
+                    '<div class="buildTypeName">Project :: Build</div>'
+                    '<span id="build:%d:text">Step 1/1</span>'
+                    '</body></html>' % agent_id)
+        self.send_body(html.encode('utf-8'), 'text/html')
+
+    def send_log(self):
+        size = self.server.log_bytes
+        block = ''.join(log_line % ('%06d' % i)
+                        for i in range(1000)).encode('ascii')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+        while size > 0:
+            self.wfile.write(block[:size])
+            size -= len(block)
+
+
+class MockTeamCityServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    # The CLI opens up to --pool-size connections at once; with the default
+    # backlog of 5, some would wait a second to be retried
+    request_queue_size = 128
+
+    def __init__(self, address, latency=0.0, builds=1000, agents=50,
+                 item_bytes=0, log_bytes=1024 * 1024, ignore_fields=False):
+        HTTPServer.__init__(self, address, MockTeamCityHandler)
+        self.latency = latency
+        self.builds = builds
+        self.agents = agents
+        self.item_bytes = item_bytes
+        self.log_bytes = log_bytes
+        self.ignore_fields = ignore_fields
+        self.requests = 0
+        self.lock = threading.Lock()
+
+
+@click.command()
+@click.option('--host', default='127.0.0.1', help='Address to listen on')
+@click.option('--port', default=8111,
+              help='Port to listen on, 0 for any free one')
+@click.option('--latency', default=0.0,
+              help='Seconds to wait before answering each request')
+@click.option('--builds', default=1000, help='Number of builds')
+@click.option('--agents', default=50, help='Number of agents')
+@click.option('--item-bytes', default=0,
+              help='Pad the JSON of each build and agent to this size')
+@click.option('--log-megabytes', default=1.0,
+              help='Size of each build log')
+@click.option('--ignore-fields', is_flag=True,
+              help='Ignore `fields=`, like older TeamCity versions')
+def main(host, port, latency, builds, agents, item_bytes, log_megabytes,
+         ignore_fields):
+    server = MockTeamCityServer(
+        (host, port), latency=latency, builds=builds, agents=agents,
+        item_bytes=item_bytes, log_bytes=int(log_megabytes * 1024 * 1024),
+        ignore_fields=ignore_fields)
+    # The benchmark suite reads the port from this line
+    click.echo('listening on http://%s:%d' % server.server_address[:2])
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""Startup time benchmark for the teamcity CLI
+
+Checks that importing teamcitycli, and running `--help`, don't import the
+modules that are only needed to talk to the server or to render output,
+and that the import stays within a time budget. Exits with status 1 if
+either check fails, so that it can run in CI.
+
+    $ python benchmarks/startup.py --max-import-ms 80
+"""
+
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+import click
+
+
+lazy_modules = ['colorclass', 'orjson', 'pygments', 'pyteamcity',
+                'requests', 'sqlite3', 'terminaltables', 'webbrowser',
+                'multiprocessing.pool']
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+list_modules_code = '''
+import json, sys
+sys.argv = ['teamcity'] + %r
+import teamcitycli
+try:
+    teamcitycli.cli()
+except SystemExit:
+    pass
+sys.stderr.write(json.dumps(sorted(sys.modules)))
+'''
+
+
+def run_python(args):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [repo_dir] + [p for p in [env.get('PYTHONPATH')] if p])
+    process = subprocess.Popen(
+        [sys.executable] + args, env=env,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+    return stdout.decode('utf-8'), stderr.decode('utf-8')
+
+
+def get_imported_modules(argv):
+    _, stderr = run_python(['-c', list_modules_code % (argv,)])
+    return json.loads(stderr.splitlines()[-1])
+
+
+def get_import_time_us():
+    _, stderr = run_python(['-X', 'importtime', '-c', 'import teamcitycli'])
+    for line in stderr.splitlines():
+        match = re.match(r'import time:\s+\d+ \|\s+(\d+) \| teamcitycli$',
+                         line)
+        if match:
+            return int(match.group(1))
+    raise RuntimeError('no import time for teamcitycli in:\n' + stderr)
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+@click.command()
+@click.option('--runs', default=15, help='Number of timed runs')
+@click.option('--max-import-ms', default=80.0,
+              help='Fail if importing teamcitycli takes longer (median)')
+def main(runs, max_import_ms):
+    failed = False
+
+    for argv in ([], ['--help'], ['build', 'list', '--help']):
+        modules = get_imported_modules(argv)
+        eager = [name for name in lazy_modules if name in modules]
+        status = 'FAIL' if eager else 'ok'
+        click.echo('%-4s teamcity %-22s imports: %s' % (
+            status, ' '.join(argv), ', '.join(eager) or '-'))
+        failed = failed or bool(eager)
+
+    import_ms = median([get_import_time_us() for _ in range(runs)]) / 1000.0
+    status = 'FAIL' if import_ms > max_import_ms else 'ok'
+    click.echo('%-4s import teamcitycli: %.1f ms (budget %.1f ms)' % (
+        status, import_ms, max_import_ms))
+    failed = failed or import_ms > max_import_ms
+
+    wall_times = []
+    for _ in range(runs):
+        start = time.time()
+        run_python(['-m', 'teamcitycli', '--help'])
+        wall_times.append(time.time() - start)
+    click.echo('     teamcity --help: %.1f ms wall time' % (
+        median(wall_times) * 1000))
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+"""End-to-end benchmarks of the teamcity CLI against a stand-in server
+
+Runs each scenario's command against benchmarks/mock_server.py, started
+afresh for it, and measures its wall time, the number of requests it made
+and the peak RSS of its process. Output goes to /dev/null, so that
+rendering is timed without a terminal. Results can be saved, and compared
+with saved ones, exiting with status 1 on a regression, to run in CI:
+
+    $ python benchmarks/suite.py --save baseline.json
+    $ python benchmarks/suite.py --compare baseline.json --max-slowdown 1.2
+
+Needs a POSIX system, for the resource usage of the CLI's processes.
+"""
+
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(benchmarks_dir)
+
+# (name, teamcity arguments, mock_server options)
+scenarios = [
+    ('build list --count 100',
+     ['build', 'list', '--count', '100'], {}),
+    ('build list --count 1000',
+     ['build', 'list', '--count', '1000'], {}),
+    ('build list --count 1000 --columns id,details',
+     ['build', 'list', '--count', '1000', '--columns', 'id,details'], {}),
+    ('build list --count 1000 --output-format json',
+     ['build', 'list', '--count', '1000', '--output-format', 'json'], {}),
+    ('build list --count 1000 --output-format ndjson',
+     ['build', 'list', '--count', '1000', '--output-format', 'ndjson'], {}),
+    ('build list --count 1000 --output-format stream-table',
+     ['build', 'list', '--count', '1000', '--output-format', 'stream-table'],
+     {}),
+    ('server agent list, 50 agents',
+     ['server', 'agent', 'list'], {'agents': 50}),
+    ('server agent list, 500 agents',
+     ['server', 'agent', 'list'], {'agents': 500}),
+    ('server agent list --output-format json, 500 agents',
+     ['server', 'agent', 'list', '--output-format', 'json'], {'agents': 500}),
+    # Older servers ignore fields=, so that the CLI has to get what the
+    # listings leave out item by item
+    ('server agent list, 50 agents, fields= ignored',
+     ['server', 'agent', 'list'], {'agents': 50, 'ignore_fields': True}),
+    ('build list --count 100, fields= ignored',
+     ['build', 'list', '--count', '100'], {'ignore_fields': True}),
+    ('build show log',
+     ['build', 'show', 'log', '1'], {'log_megabytes': 1024}),
+]
+
+run_cli_code = '''
+import teamcitycli
+teamcitycli.cli(prog_name='teamcity')
+'''
+
+
+class MockServer(object):
+    """benchmarks/mock_server.py, running in a process of its own"""
+
+    def __init__(self, **options):
+        args = [sys.executable,
+                os.path.join(benchmarks_dir, 'mock_server.py'), '--port', '0']
+        for name, value in sorted(options.items()):
+            option = '--%s' % name.replace('_', '-')
+            if value is True:
+                args.append(option)
+            elif value is not False:
+                args += [option, str(value)]
+        self.process = subprocess.Popen(args, stdout=subprocess.PIPE)
+        line = self.process.stdout.readline().decode('utf-8')
+        match = re.search(r':(\d+)$', line.strip())
+        if match is None:
+            self.close()
+            raise click.ClickException('mock server did not start')
+        self.port = int(match.group(1))
+
+    def get_requests(self):
+        try:
+            from urllib.request import urlopen
+        except ImportError:
+            from urllib2 import urlopen
+        response = urlopen('http://127.0.0.1:%d/mock/stats' % self.port)
+        return json.loads(response.read().decode('utf-8'))['requests']
+
+    def close(self):
+        self.process.terminate()
+        self.process.wait()
+        self.process.stdout.close()
+
+
+def get_max_rss_bytes(rusage):
+    # ru_maxrss is in kilobytes on Linux, but in bytes on macOS
+    if sys.platform == 'darwin':
+        return rusage.ru_maxrss
+    return rusage.ru_maxrss * 1024
+
+
+def run_cli(argv, port, cache_dir):
+    """Run teamcity with argv, returning (wall time, peak RSS in bytes)"""
+    env = dict((name, value) for name, value in os.environ.items()
+               if not name.startswith('TEAMCITY_'))
+    env.update({
+        'TEAMCITY_HOST': '127.0.0.1',
+        'TEAMCITY_PORT': str(port),
+        'XDG_CACHE_HOME': cache_dir,
+        'PYTHONPATH': os.pathsep.join(
+            [repo_dir] + [p for p in [os.environ.get('PYTHONPATH')] if p]),
+    })
+    with open(os.devnull, 'wb') as devnull:
+        start = time.time()
+        process = subprocess.Popen(
+            [sys.executable, '-c', run_cli_code, '--no-cache'] + argv,
+            env=env, stdout=devnull, stderr=subprocess.PIPE)
+        stderr = process.stderr.read()
+        _, status, rusage = os.wait4(process.pid, 0)
+        wall_time = time.time() - start
+    process.stderr.close()
+    if os.WIFEXITED(status):
+        process.returncode = os.WEXITSTATUS(status)
+    else:
+        process.returncode = -os.WTERMSIG(status)
+    if process.returncode != 0:
+        raise click.ClickException('teamcity %s failed:\n%s' % (
+            ' '.join(argv), stderr.decode('utf-8', 'replace')))
+    return wall_time, get_max_rss_bytes(rusage)
+
+
+def run_scenario(argv, server_options, runs, cache_dir):
+    server = MockServer(**server_options)
+    try:
+        wall_times = []
+        max_rss = 0
+        requests = None
+        for _ in range(runs):
+            before = server.get_requests()
+            wall_time, rss = run_cli(argv, server.port, cache_dir)
+            requests = server.get_requests() - before
+            wall_times.append(wall_time)
+            max_rss = max(max_rss, rss)
+    finally:
+        server.close()
+    return {
+        'wall_time': min(wall_times),
+        'requests': requests,
+        'max_rss': max_rss,
+    }
+
+
+def compare(result, baseline, max_slowdown):
+    """Return the ways in which result regressed from baseline"""
+    problems = []
+    if result['wall_time'] > baseline['wall_time'] * max_slowdown:
+        problems.append('%.1fx slower' % (
+            result['wall_time'] / baseline['wall_time']))
+    if result['requests'] > baseline['requests']:
+        problems.append('%d more requests' % (
+            result['requests'] - baseline['requests']))
+    if result['max_rss'] > baseline['max_rss'] * max_slowdown:
+        problems.append('%.1fx more memory' % (
+            float(result['max_rss']) / baseline['max_rss']))
+    return problems
+
+
+@click.command()
+@click.option('--runs', default=3,
+              help='Runs of each scenario; the fastest one counts')
+@click.option('--latency', default=0.0,
+              help='Seconds that the server waits before each response')
+@click.option('--item-bytes', default=0,
+              help='Pad the JSON of each build and agent to this size')
+@click.option('--log-megabytes', default=None, type=float,
+              help='Size of the build log (default: 1024)')
+@click.option('--only', default=None,
+              help='Only run the scenarios whose name matches this regex')
+@click.option('--save', default=None, type=click.Path(dir_okay=False),
+              help='Save the results to a JSON file')
+@click.option('--compare', 'compare_path', default=None,
+              type=click.Path(exists=True, dir_okay=False),
+              help='Compare the results with ones saved with --save')
+@click.option('--max-slowdown', default=1.25,
+              help='With --compare, how many times slower (or bigger) a '
+                   'scenario may be before it counts as a regression')
+def main(runs, latency, item_bytes, log_megabytes, only, save, compare_path,
+         max_slowdown):
+    baselines = {}
+    if compare_path is not None:
+        with open(compare_path) as f:
+            baselines = json.load(f)['scenarios']
+
+    results = {}
+    regressed = False
+    cache_dir = tempfile.mkdtemp(prefix='teamcity_cli_benchmarks')
+    try:
+        click.echo('%-56s %9s %9s %9s' % (
+            'scenario', 'wall (s)', 'requests', 'RSS (MB)'))
+        for name, argv, server_options in scenarios:
+            if only is not None and not re.search(only, name):
+                continue
+            server_options = dict(server_options, latency=latency,
+                                  item_bytes=item_bytes)
+            if log_megabytes is not None:
+                server_options['log_megabytes'] = log_megabytes
+            result = run_scenario(argv, server_options, runs, cache_dir)
+            results[name] = result
+            line = '%-56s %9.2f %9d %9.1f' % (
+                name, result['wall_time'], result['requests'],
+                result['max_rss'] / 1024.0 / 1024)
+            if name in baselines:
+                problems = compare(result, baselines[name], max_slowdown)
+                if problems:
+                    regressed = True
+                    line += '  FAIL: %s' % ', '.join(problems)
+            click.echo(line)
+    finally:
+        shutil.rmtree(cache_dir)
+
+    if save is not None:
+        with open(save, 'w') as f:
+            json.dump({'python': sys.version.split()[0],
+                       'latency': latency, 'item_bytes': item_bytes,
+                       'scenarios': results}, f, indent=2, sort_keys=True)
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == '__main__':
+    main()
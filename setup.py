@@ -13,18 +13,24 @@ setup(
     author='Marc Abramowitz',
     author_email='marca@surveymonkey.com',
     url='https://github.com/SurveyMonkey/teamcity_cli',
-    py_modules=['teamcitycli'],
+    py_modules=['teamcitycli', 'teamcitycli_async', 'teamcitycli_client'],
     zip_safe=False,
     install_requires=[
         'click',
         'colorclass',
         'pygments',
         'pyteamcity',
+        'requests',
         'terminaltables'
     ],
+    extras_require={
+        'async': ['httpx'],
+        'fast': ['orjson'],
+    },
     entry_points="""\
       [console_scripts]
       teamcity = teamcitycli:cli
+      teamcity-client = teamcitycli_client:main
     """,
     license='MIT',
     classifiers=[
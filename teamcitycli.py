@@ -1,45 +1,1784 @@
 #!/usr/bin/env python
 
+import calendar
+import collections
+import contextlib
+import datetime
+import errno
+import functools
+import hashlib
+import io
+import itertools
 import json
+import math
+import os
+import random
+import re
 import sys
+import threading
 import time
-import webbrowser
 
 import click
-from colorclass import Color
-import pygments.formatters
-import pygments.lexers
-from pyteamcity import TeamCity, HTTPError
-import terminaltables
 
+# The other dependencies, and heavier stdlib modules, are imported where
+# they are used, so that `--help`, and commands that don't need them,
+# start quickly. benchmarks/startup.py checks this.
 
-lexer = pygments.lexers.get_lexer_by_name('json')
-formatter = pygments.formatters.TerminalFormatter()
+lexer = formatter = None
+json_backend = None
+# Clients kept between commands by `teamcity daemon`, by their settings
+warm_clients = None
 
 default_build_list_columns = 'status,statusText,id,buildTypeId,number,branchName,user'
 default_build_configs_list_columns = 'id,projectName,name'
 default_queued_build_list_columns = 'state,id,buildTypeId,branchName,user'
 default_project_list_columns = 'name,id,parentProjectId'
 default_agent_list_columns = 'name,id,ip,pool,build_type,build_text'
+default_concurrency = 8
+default_pool_size = 16
+default_timeout = 60
+default_poll_interval = 1
+stream_table_window = 20
+bulk_chunk_size = 100
+output_formats = ['table', 'stream-table', 'json', 'ndjson']
+json_output_formats = ['json', 'ndjson']
+max_poll_interval = 30
+# Polls of a build that fail in a row before it is given up on
+max_poll_errors = 5
+default_retries = 2
+retry_backoff = 0.5
+max_retry_delay = 30
+# Responses to GETs that are worth trying again
+retry_statuses = (429, 502, 503, 504)
+# Requests sent, kept for the --debug and --trace reports
+max_traces = 10000
+trace_percentiles = (50, 95)
+
+
+def output_json_data(data, output_format='json'):
+    if output_format == 'ndjson':
+        output_ndjson([data])
+        return
+    ctx = click.get_current_context(silent=True)
+    compact = ctx is not None and ctx.meta.get('teamcity.compact_json')
+    output = dumps_json(data, compact=compact)
+    if use_color():
+        global lexer, formatter
+        import pygments
+        if lexer is None:
+            import pygments.formatters
+            import pygments.lexers
+            lexer = pygments.lexers.get_lexer_by_name('json')
+            formatter = pygments.formatters.TerminalFormatter()
+        output = pygments.highlight(output, lexer, formatter).strip()
+    click.echo(output)
 
 
-def output_json_data(data):
-    output = json.dumps(data, indent=4)
-    output = pygments.highlight(output, lexer, formatter).strip()
-    click.echo(output)
+def use_color():
+    """Whether output is colored
+
+    As set by --color/--no-color, otherwise only when stdout is a TTY.
+    """
+    ctx = click.get_current_context(silent=True)
+    if ctx is not None and ctx.color is not None:
+        return ctx.color
+    return sys.stdout.isatty()
+
+
+def output_ndjson(items):
+    """Write each of items as compact JSON on a line of its own
+
+    Lines are written as items come, so items can be a generator.
+    """
+    with exit_on_broken_pipe():
+        for item in items:
+            click.echo(dumps_json(item, compact=True))
+
+
+def get_json_backend():
+    """orjson if it is installed, otherwise the json module"""
+    global json_backend
+    if json_backend is None:
+        try:
+            import orjson
+            json_backend = orjson
+        except ImportError:
+            json_backend = json
+    return json_backend
+
+
+def dumps_json(data, compact=False):
+    """Serialize data to JSON indented by 4 spaces, or with compact, to a
+    single line
+
+    Only compact JSON uses orjson, if installed, as it can't indent by 4
+    spaces and indented output shouldn't depend on what is installed.
+    """
+    backend = get_json_backend()
+    if not compact:
+        return json.dumps(data, indent=4)
+    if backend is json:
+        return json.dumps(data, separators=(',', ':'))
+    return backend.dumps(data, option=backend.OPT_NON_STR_KEYS).decode(
+        'utf-8')
+
+
+def loads_json(content):
+    """Deserialize JSON bytes or text with the same backend as dumps_json"""
+    return get_json_backend().loads(content)
+
+
+def use_json_backend(response):
+    """Make response.json() decode with loads_json"""
+    response.json = lambda **kwargs: loads_json(response.content)
+    return response
+
+
+def output_reports(client, debug=False, trace=False, trace_file=None):
+    """Report on the requests made by client, to stderr
+
+    The requests are reported on once; a client kept by `teamcity daemon`
+    only reports those of the current command.
+    """
+    if client.teamcity is None:
+        return
+    traces = list(client.session.traces)
+    client.session.traces.clear()
+    if debug:
+        output_debug_report(client, traces)
+    if trace:
+        output_trace_summary(traces)
+    if trace_file is not None:
+        write_chrome_trace(traces, trace_file)
+
+
+def output_debug_report(client, traces):
+    for trace in traces:
+        sys.stderr.write('%s\n' % trace)
+    connection_stats = [('connections', client.session.get_connection_stats())]
+    # The async backend sends the requests it fans out with httpx instead
+    if getattr(client, 'backend', 'sync') == 'async':
+        connection_stats.append(
+            ('async connections', client.teamcity.get_connection_stats()))
+    for name, stats in connection_stats:
+        sys.stderr.write(
+            '%s: %d opened, %d requests, %d reused\n' % (
+                name, stats['connections'], stats['requests'],
+                stats['requests'] - stats['connections']))
+    limiter = client.session.limiter
+    if limiter is not None:
+        sys.stderr.write('rate limiter: %d requests waited, %.2f s in all\n'
+                         % (limiter.waits, limiter.wait_seconds))
+
+
+def get_endpoint(url):
+    """The path of url, with the IDs in it replaced by *"""
+    from requests.compat import urlparse
+    path = urlparse(url).path
+    path = re.sub(r'(?<=:)[^/,()]+', '*', path)
+    return re.sub(r'/\d+(?=/|$)', '/*', path)
+
+
+def get_percentile(values, percent):
+    """The nearest-rank percentile of sorted values"""
+    rank = max(int(math.ceil(percent / 100.0 * len(values))), 1)
+    return values[rank - 1]
+
+
+def output_trace_summary(traces):
+    """Print how long requests took, by method and endpoint"""
+    by_endpoint = collections.OrderedDict()
+    for trace in traces:
+        key = (trace.method, get_endpoint(trace.url))
+        by_endpoint.setdefault(key, []).append(trace)
+    header = (['endpoint', 'count', 'cached'] +
+              ['p%d' % percent for percent in trace_percentiles] +
+              ['max', 'bytes'])
+    rows = []
+    for (method, endpoint), endpoint_traces in by_endpoint.items():
+        totals = sorted(trace.total for trace in endpoint_traces)
+        rows.append(
+            ['%s %s' % (method, endpoint), str(len(totals)),
+             str(sum(1 for trace in endpoint_traces
+                     if trace.cache == 'hit'))] +
+            ['%.3f' % get_percentile(totals, percent)
+             for percent in trace_percentiles] +
+            ['%.3f' % totals[-1],
+             str(sum(trace.bytes or 0 for trace in endpoint_traces))])
+    widths = [max(len(row[idx]) for row in [header] + rows)
+              for idx in range(len(header))]
+    for row in [header] + rows:
+        # Left-align the endpoint, right-align the numbers
+        cells = [row[0].ljust(widths[0])] + [
+            value.rjust(width) for value, width in zip(row[1:], widths[1:])]
+        sys.stderr.write('  '.join(cells) + '\n')
+
+
+def write_chrome_trace(traces, path):
+    """Write traces to path in Chrome's trace event format
+
+    For chrome://tracing or https://ui.perfetto.dev. Requests that overlap
+    in time are put on separate rows, reusing rows as they free up.
+    """
+    events = []
+    row_ends = []
+    start = min([trace.start for trace in traces] or [0])
+    for trace in sorted(traces, key=lambda trace: trace.start):
+        for row, end in enumerate(row_ends):
+            if end <= trace.start:
+                break
+        else:
+            row = len(row_ends)
+            row_ends.append(None)
+        row_ends[row] = trace.start + trace.total
+        events.append({
+            'name': '%s %s' % (trace.method, get_endpoint(trace.url)),
+            'cat': 'cache' if trace.cache == 'hit' else 'http',
+            'ph': 'X',
+            'ts': (trace.start - start) * 1e6,
+            'dur': trace.total * 1e6,
+            'pid': os.getpid(),
+            'tid': row,
+            'args': trace.as_dict(),
+        })
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+def get_retry_delay(attempt, response=None):
+    """Seconds to wait before retrying a request for the attempt-th time
+
+    attempt counts from 0. If the server said how long to wait, with the
+    Retry-After header of response, that is how long, up to
+    max_retry_delay. Otherwise the wait doubles with each attempt, with
+    random jitter so that many clients don't retry in step.
+    """
+    retry_after = response is not None and \
+        response.headers.get('Retry-After')
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            import email.utils
+            date = email.utils.parsedate_tz(retry_after)
+            delay = date and email.utils.mktime_tz(date) - time.time()
+        if delay is not None:
+            return min(max(delay, 0), max_retry_delay)
+    delay = min(retry_backoff * 2 ** attempt, max_retry_delay)
+    return delay * random.uniform(0.8, 1.2)
+
+
+class RequestError(click.ClickException):
+    """A request that failed, with the message of why
+
+    Carries the message, rather than printing it, so that commands that
+    make many requests can report it once along with the item it was for.
+    """
+
+    def show(self, file=None):
+        sys.stderr.write('ERROR: %s\n' % self.format_message())
 
 
 def error_handler(e):
-    sys.stderr.write('ERROR: %s\n' % e)
-    raise click.Abort()
+    raise RequestError(str(e))
+
+
+def get_json(client, url):
+    """GET url with client and return the decoded JSON response
+
+    For requests that the pyteamcity API can't make by itself, such as ones
+    with a `fields=` parameter.
+    """
+    from pyteamcity import HTTPError
+    import requests
+    response = client._get(url)
+    try:
+        response.raise_for_status()
+    except requests.exceptions.HTTPError:
+        raise HTTPError(response.text,
+                        url=url,
+                        status_code=response.status_code)
+    return response.json()
+
+
+def get_with_fields(func, fields, return_type='data', **kwargs):
+    """Call a pyteamcity GET method with a `fields=` parameter added
+
+    func must be a bound method that supports return_type='url'.
+    """
+    url = func(return_type='url', **kwargs)
+    url += ('&' if '?' in url else '?') + 'fields=' + fields
+    if return_type == 'url':
+        return url
+    return get_json(func.__self__, url)
+
+
+def get_build_log_response(client, build_id, headers=None):
+    """Start downloading the log of a build
+
+    Same request as pyteamcity's get_build_log_by_build_id, but streamed,
+    so the log is read as it arrives instead of being held in memory. The
+    caller must close the response.
+    """
+    from pyteamcity import HTTPError
+    import requests
+    url = '%s/downloadBuildLog.html?buildId=%s' % (
+        client.guest_auth_base_url, build_id)
+    request = client._get_request('GET', url, headers=headers)
+    try:
+        response = client.session.send(request, stream=True)
+    except requests.exceptions.ConnectionError as e:
+        error_handler(e)
+    if response.status_code >= 400:
+        response.close()
+        raise HTTPError(response.text, url=url,
+                        status_code=response.status_code)
+    return response
+
+
+def follow_build_log(client, build_id, poll_interval=default_poll_interval):
+    """Yield the log of a build as chunks of bytes while it grows
+
+    Each poll only asks for the bytes after those already seen, with a
+    Range header. If the server ignores it, the bytes seen are skipped
+    instead. Polls get further apart, up to max_poll_interval, while
+    nothing is added to the log. Ends once the build has finished.
+    """
+    from pyteamcity import HTTPError
+    offset = 0
+    interval = poll_interval
+    while True:
+        # Look at the state first, so the log fetched afterwards is
+        # complete when the build has finished
+        with client.session.refreshing():
+            finished = client.get_build_by_build_id(
+                build_id)['state'] == 'finished'
+        # Offsets must be in the log's bytes, not in a compressed encoding
+        headers = {'Range': 'bytes=%d-' % offset,
+                   'Accept-Encoding': 'identity'}
+        received = 0
+        try:
+            response = get_build_log_response(client, build_id, headers)
+        except HTTPError as e:
+            # 416 Range Not Satisfiable: nothing after offset yet
+            if e.status_code != 416:
+                raise
+        else:
+            skip = offset if response.status_code != 206 else 0
+            try:
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    if skip >= len(chunk):
+                        skip -= len(chunk)
+                        continue
+                    chunk, skip = chunk[skip:], 0
+                    received += len(chunk)
+                    yield chunk
+            finally:
+                response.close()
+        offset += received
+        if finished:
+            return
+        if received:
+            interval = poll_interval
+        else:
+            interval = min(interval * 2, max_poll_interval)
+        time.sleep(interval)
+
+
+def parse_teamcity_date(value):
+    """Convert a TeamCity date, like 20160503T162531+0000, to a timestamp"""
+    date = datetime.datetime.strptime(value[:15], '%Y%m%dT%H%M%S')
+    offset = int(value[16:18]) * 3600 + int(value[18:20]) * 60
+    if value[15] == '-':
+        offset = -offset
+    return calendar.timegm(date.timetuple()) - offset
+
+
+def get_seconds_to_go(build):
+    """Estimate when a queued build starts or a running build finishes"""
+    try:
+        if build['state'] == 'queued':
+            return parse_teamcity_date(build['startEstimate']) - time.time()
+        info = build['running-info']
+        return info['estimatedTotalSeconds'] - info['elapsedSeconds']
+    except (KeyError, IndexError, ValueError):
+        return None
+
+
+def wait_for_builds(client, build_ids, states, timeout=None,
+                    poll_interval=default_poll_interval,
+                    concurrency=default_concurrency, err=False):
+    """Poll triggered builds until the state of each is one of states
+
+    All builds still waited for are polled together, in parallel. Polls
+    back off exponentially, up to max_poll_interval, but skip ahead to
+    when the server estimates that the next build starts or finishes.
+    Random jitter keeps many waiting clients from polling in step. Build
+    states are printed whenever they change, to stderr with err. A build
+    whose polls fail max_poll_errors times in a row, e.g. because it was
+    deleted, is given up on. Returns (done, errors): dicts of the data of
+    each build that got there before timeout seconds passed, and of the
+    last error of each build given up on.
+    """
+    deadline = None if timeout is None else time.time() + timeout
+    interval = poll_interval
+    builds = {}
+    done = {}
+    errors = {}
+    error_counts = collections.Counter()
+
+    def poll(build_id):
+        last = builds.get(build_id)
+        with client.session.refreshing():
+            if last is None or last['state'] == 'queued':
+                return client.get_queued_build_by_build_id(build_id)
+            return client.get_build_by_build_id(build_id)
+
+    pending = list(build_ids)
+    while True:
+        delays = []
+        for build_id, build, error in concurrent_map(poll, pending,
+                                                     concurrency):
+            if error is not None:
+                sys.stderr.write('ERROR: build %s: %s\n' % (build_id, error))
+                error_counts[build_id] += 1
+                if error_counts[build_id] >= max_poll_errors:
+                    errors[build_id] = error
+                delays.append(interval)
+                continue
+            error_counts[build_id] = 0
+            last = builds.get(build_id)
+            if last is None or last['state'] != build['state']:
+                prefix = 'build %s ' % build_id if len(build_ids) > 1 else ''
+                click.echo('%sstate: %s' % (prefix, build['state']), err=err)
+            builds[build_id] = build
+            if build['state'] in states:
+                done[build_id] = build
+            else:
+                delays.append(max(interval, get_seconds_to_go(build) or 0))
+        pending = [build_id for build_id in pending
+                   if build_id not in done and build_id not in errors]
+        if not pending:
+            return done, errors
+        if deadline is not None and time.time() >= deadline:
+            return done, errors
+        delay = min(min(delays), max_poll_interval)
+        delay *= random.uniform(0.8, 1.2)
+        if deadline is not None:
+            delay = min(delay, deadline - time.time())
+        time.sleep(max(delay, 0))
+        interval = min(interval * 2, max_poll_interval)
+
+
+def read_build_type_branches(lines):
+    """Parse lines of `BUILD_TYPE_ID [BRANCH]`, skipping blanks and #s"""
+    for line in lines:
+        words = line.split()
+        if words and not words[0].startswith('#'):
+            yield words[0], words[1] if len(words) > 1 else None
+
+
+def iter_ids(args, ids_from=None):
+    """Yield the IDs in args, then those read from ids_from as needed
+
+    ids_from has an ID per line; blank lines and #s are skipped, and
+    quotes around an ID, as `jq .id` writes for strings, are dropped.
+    """
+    for item_id in args:
+        yield item_id
+    if ids_from is None:
+        return
+    for line in ids_from:
+        line = line.strip().strip('"')
+        if line and not line.startswith('#'):
+            yield line
+
+
+def iter_lines(chunks):
+    """Split chunks of bytes into lines, keeping their line endings"""
+    pending = b''
+    for chunk in chunks:
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + b'\n'
+    if pending:
+        yield pending
+
+
+def filter_log(chunks, head=None, tail=None, pattern=None):
+    """Filter a log, given as chunks of bytes, as it streams by
+
+    Keeps the lines matching the regular expression pattern, then the
+    first head and the last tail of those.
+    """
+    if head is None and tail is None and pattern is None:
+        return chunks
+    lines = iter_lines(chunks)
+    if pattern is not None:
+        regex = re.compile(pattern.encode('utf-8'))
+        lines = (line for line in lines if regex.search(line))
+    if head is not None:
+        lines = itertools.islice(lines, head)
+    if tail is not None:
+        lines = collections.deque(lines, maxlen=tail)
+    return lines
+
+
+@contextlib.contextmanager
+def exit_on_broken_pipe():
+    """Exit quietly when stdout is closed early, e.g. by `| head`"""
+    try:
+        yield
+    except IOError as e:
+        if e.errno != errno.EPIPE:
+            raise
+        try:
+            fileno = sys.stdout.fileno()
+        except (AttributeError, ValueError):
+            # Not a file, e.g. the client's stream in `teamcity daemon`
+            sys.exit(1)
+        # Python would complain again when flushing stdout on exit
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, fileno)
+        sys.exit(1)
+
+
+def output_bytes(chunks):
+    """Write chunks of bytes to stdout as they come"""
+    stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+    interactive = stdout.isatty()
+    with exit_on_broken_pipe():
+        for chunk in chunks:
+            stdout.write(chunk)
+            if interactive:
+                stdout.flush()
+        stdout.flush()
+
+
+def concurrent_map(func, items, concurrency=default_concurrency):
+    """Call func on each of items using a bounded pool of threads
+
+    Yields (item, result, error) tuples in the same order as items. At most
+    `concurrency` calls run at once. An exception raised by func is yielded
+    as error instead of being raised, so one failed item does not stop the
+    others.
+    """
+    def call(item):
+        try:
+            return item, func(item), None
+        except Exception as e:
+            return item, None, e
+
+    if concurrency <= 1:
+        for item in items:
+            yield call(item)
+        return
+
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(concurrency)
+    pending = collections.deque()
+    try:
+        for item in items:
+            pending.append(pool.apply_async(call, (item,)))
+            # Keep a few extra items queued so that workers stay busy while
+            # the caller consumes results, without reading all of items
+            if len(pending) >= 2 * concurrency:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+
+
+def fan_out(client, func, items, concurrency=default_concurrency):
+    """Call func(client, item) on each of items in parallel
+
+    func returns a dict of the responses to the requests it makes for
+    item. Yields (item, responses, error) tuples like concurrent_map. With
+    the async backend, func is given the client's coroutine methods, so
+    that the dict is of awaitables, which run on the client's event loop.
+    """
+    if getattr(client, 'backend', None) == 'async':
+        return client.gather_map(func, items, concurrency)
+    return concurrent_map(functools.partial(func, client), items,
+                          concurrency)
+
+
+def iter_pages(client, func, item_name, limit=None,
+               concurrency=default_concurrency, start=0, count=100,
+               **kwargs):
+    """Yield the items of a TeamCity list, page after page
+
+    func is a pyteamcity GET method taking start and count, possibly
+    wrapped with get_with_fields. With limit, the pages to get are known
+    upfront and are fetched concurrently. Otherwise TeamCity's nextHref is
+    followed to the last page, getting each page while the previous one
+    is consumed; if fields are asked for, they must include nextHref.
+    """
+    if limit is not None:
+        def get_page(page_start):
+            page_count = min(count, start + limit - page_start)
+            url = func(return_type='url', start=page_start, count=page_count,
+                       **kwargs)
+            return page_count, get_json(client, url)
+
+        pages = concurrent_map(get_page, range(start, start + limit, count),
+                               concurrency)
+        for _, result, error in pages:
+            if error is not None:
+                raise error
+            page_count, page = result
+            items = page.get(item_name, [])
+            for item in items:
+                yield item
+            if len(items) < page_count:
+                return
+        return
+
+    url = func(return_type='url', start=start, count=count, **kwargs)
+    # nextHref doesn't always carry the fields over
+    fields = re.search(r'[?&](fields=[^&]*)', url)
+
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(1)
+    try:
+        result = pool.apply_async(get_json, (client, url))
+        while result is not None:
+            page = result.get()
+            result = None
+            if page.get('nextHref'):
+                url = client.base_base_url + page['nextHref']
+                if fields and 'fields=' not in url:
+                    url += ('&' if '?' in url else '?') + fields.group(1)
+                result = pool.apply_async(get_json, (client, url))
+            for item in page.get(item_name, []):
+                yield item
+    finally:
+        pool.terminate()
+
+
+def bulk_map(func, get_many, items, concurrency,
+             chunk_size=bulk_chunk_size):
+    """Like concurrent_map, but getting chunk_size items per call to get_many
+
+    get_many takes a list of items and returns a dict of the results for
+    the ones it found. func is only called for the others, or for all of
+    a chunk if get_many fails. Chunks are got in parallel.
+    """
+    items = iter(items)
+    chunks = iter(lambda: list(itertools.islice(items, chunk_size)), [])
+    for chunk, found, error in concurrent_map(get_many, chunks,
+                                              concurrency):
+        found = found or {}
+        missing = [item for item in chunk if item not in found]
+        results = dict((item, (item, result, error)) for item, result, error
+                       in concurrent_map(func, missing, concurrency))
+        for item in chunk:
+            if item in found:
+                yield item, found[item], None
+            else:
+                yield results[item]
+
+
+def get_items_by_ids(client, path, item_name, ids):
+    """Get the items with ids in one request to the listing at path
+
+    Uses an item: multi-locator, asking for the same fields as getting
+    each item on its own would return. Returns a dict of the items by
+    ID. IDs that aren't plain numbers are left out, so that they can't
+    change the meaning of the locator.
+
+    With a cache, items are looked up under, and stored as, the responses
+    to getting each of them on its own, so that only the ones that aren't
+    cached are requested.
+    """
+    ids = [item_id for item_id in ids if str(item_id).isdigit()]
+    if not ids:
+        return {}
+    session = client.session
+    found = {}
+    item_requests = {}
+    if session.cache is not None:
+        for item_id in ids:
+            item_requests[item_id] = client._get_request(
+                'GET', '%s/%s/id:%s' % (client.base_url, path, item_id))
+        if not session.is_refreshing():
+            for item_id, request in item_requests.items():
+                response = session.get_cached_response(
+                    request.url, request.headers, request)
+                if response is not None:
+                    found[item_id] = response.json()
+    missing = [item_id for item_id in ids if item_id not in found]
+    if not missing:
+        return found
+
+    locator = ','.join('item:(id:%s)' % item_id for item_id in missing)
+    url = '%s/%s?locator=%s&fields=%s($long)' % (
+        client.base_url, path, locator, item_name)
+    data = get_json(client, url)
+    items = dict((str(item['id']), item) for item in data.get(item_name, []))
+    for item_id in missing:
+        if str(item_id) not in items:
+            continue
+        found[item_id] = items[str(item_id)]
+        if session.cache is not None:
+            session.cache_response(item_requests[item_id],
+                                   make_json_response(found[item_id]))
+    return found
+
+
+def make_json_response(data):
+    """A 200 response with data as JSON, as if TeamCity had sent it"""
+    import requests
+    response = requests.Response()
+    response.status_code = 200
+    response.reason = 'OK'
+    response.headers['Content-Type'] = 'application/json'
+    response._content = dumps_json(data, compact=True).encode('utf-8')
+    return use_json_backend(response)
+
+
+def show_each(func, ids, output, item_name, concurrency, get_many=None):
+    """Get each of ids with func, in parallel, and output them in order
+
+    With get_many, see bulk_map, IDs are got many per request instead.
+    An ID that can't be got is reported on stderr without stopping the
+    others, and the exit status then is 1.
+    """
+    if get_many is None:
+        results = concurrent_map(func, ids, concurrency)
+    else:
+        results = bulk_map(func, get_many, ids, concurrency)
+    failed = False
+    for item_id, data, error in results:
+        if error is not None:
+            sys.stderr.write('ERROR: %s %s: %s\n' % (
+                item_name, item_id, error))
+            failed = True
+        else:
+            output(data)
+    if failed:
+        sys.exit(1)
+
+
+# Seconds that GET responses are cached for, by the first pattern that
+# matches the URL path. None means for max_cache_age, as the data won't
+# change. Unmatched URLs aren't cached.
+cache_ttls = [
+    # None once the build has finished, see get_cache_ttl
+    (r'/builds/id:[^/]+$', 5),
+    (r'/builds/id:[^/]+/(statistics|resulting-properties)$', 5),
+    (r'/builds/id:[^/]+/artifacts', 0),
+    (r'/builds/', 5),
+    (r'/changes/id:[^/]+$', None),
+    (r'/changes', 30),
+    (r'/buildQueue', 5),
+    (r'/agents', 5),
+    (r'/agentDetails\.html$', 5),
+    (r'/(projects|buildTypes|users|vcs-roots)', 300),
+    (r'/server', 3600),
+]
+# Larger responses aren't worth keeping in the database
+max_cached_response_bytes = 10 * 1024 * 1024
+# Even responses that won't change are deleted after this many seconds,
+# so that the cache doesn't keep growing
+max_cache_age = 30 * 24 * 3600
+
+
+def get_cache_path():
+    cache_dir = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_dir, 'teamcity_cli', 'responses.sqlite')
+
+
+class ResponseCache(object):
+    """Persistent store of HTTP responses, in a sqlite database
+
+    Responses can hold private data, so only the user can read the
+    database. Expired responses are deleted when it is closed.
+    """
+
+    def __init__(self, path):
+        import sqlite3
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        cache_dir = os.path.dirname(path)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, 0o700)
+        # Also for caches made before they were private
+        os.chmod(cache_dir, 0o700)
+        os.close(os.open(path, os.O_RDWR | os.O_CREAT, 0o600))
+        os.chmod(path, 0o600)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS responses ('
+                            'key TEXT PRIMARY KEY, expires REAL, '
+                            'status INTEGER, headers TEXT, content BLOB)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS responses_expires '
+                            'ON responses (expires)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS counters ('
+                            'name TEXT PRIMARY KEY, value INTEGER)')
+            # Stored to be kept forever, before max_cache_age
+            self.db.execute('UPDATE responses SET expires = ? '
+                            'WHERE expires IS NULL',
+                            (time.time() + max_cache_age,))
+
+    def get(self, key, count=True):
+        """Return (status, headers, content) for key, or None if expired
+
+        With count, the lookup counts towards the hits and misses stats.
+        """
+        with self.lock:
+            row = self.db.execute(
+                'SELECT expires, status, headers, content FROM responses '
+                'WHERE key = ?', (key,)).fetchone()
+            found = row is not None and row[0] >= time.time()
+            if count and found:
+                self.hits += 1
+            elif count:
+                self.misses += 1
+        if not found:
+            return None
+        return row[1], json.loads(row[2]), bytes(row[3])
+
+    def set(self, key, ttl, status, headers, content):
+        if len(content) > max_cached_response_bytes:
+            return
+        expires = time.time() + (max_cache_age if ttl is None else ttl)
+        with self.lock, self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+                (key, expires, status, json.dumps(dict(headers)),
+                 memoryview(content)))
+
+    def clear(self, expired_only=False):
+        """Delete entries and return how many were deleted"""
+        with self.lock, self.db:
+            if expired_only:
+                cursor = self.db.execute(
+                    'DELETE FROM responses WHERE expires < ?', (time.time(),))
+            else:
+                cursor = self.db.execute('DELETE FROM responses')
+                self.db.execute('DELETE FROM counters')
+        return cursor.rowcount
+
+    def stats(self):
+        with self.lock:
+            entries, expired, size = self.db.execute(
+                'SELECT COUNT(*), SUM(expires < ?), '
+                'SUM(LENGTH(content)) FROM responses',
+                (time.time(),)).fetchone()
+            counters = dict(self.db.execute('SELECT * FROM counters'))
+        return {
+            'path': self.path,
+            'entries': entries,
+            'expired_entries': expired or 0,
+            'content_bytes': size or 0,
+            'hits': counters.get('hits', 0),
+            'misses': counters.get('misses', 0),
+        }
+
+    def close(self):
+        self.clear(expired_only=True)
+        with self.lock, self.db:
+            for name, value in (('hits', self.hits),
+                                ('misses', self.misses)):
+                self.db.execute(
+                    'INSERT OR IGNORE INTO counters VALUES (?, 0)', (name,))
+                self.db.execute(
+                    'UPDATE counters SET value = value + ? WHERE name = ?',
+                    (value, name))
+        self.db.close()
+
+
+def open_response_cache():
+    """The ResponseCache at get_cache_path(), or None if it can't be
+    opened, e.g. because HOME is read-only, so commands still work"""
+    import sqlite3
+    try:
+        return ResponseCache(get_cache_path())
+    except (OSError, sqlite3.Error) as e:
+        sys.stderr.write('WARNING: not caching responses: %s\n' % e)
+        return None
+
+
+class RequestTrace(object):
+    """What a request got, and how long it took, for the --debug and
+    --trace reports
+
+    Times are in seconds from start, when the request was first going to
+    be sent, to when its response (or, if streamed, its headers) had come
+    through any retries. dns and connect are only set if a connection was
+    opened for the request while tracing, see get_traced_pool_classes.
+    cache is 'hit', 'miss' or 'refresh' for cacheable GETs.
+    """
+
+    def __init__(self, method, url, cache=None):
+        self.method = method
+        self.url = url
+        self.cache = cache
+        self.start = time.time()
+        self.status = None
+        self.bytes = None
+        self.dns = self.connect = self.ttfb = self.total = None
+        self.attempts = 1
+        self.hedged = False
+
+    def finish(self, status, response=None):
+        """Record the outcome, a status code or an error's name"""
+        self.total = time.time() - self.start
+        self.status = status
+        if response is None:
+            return
+        if response._content is not False:
+            self.bytes = len(response._content or b'')
+        elif 'Content-Length' in response.headers:
+            self.bytes = int(response.headers['Content-Length'])
+        if response.elapsed and hasattr(response, 'sent_at'):
+            self.ttfb = response.sent_at - self.start + \
+                response.elapsed.total_seconds()
+
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name in (
+            'method', 'url', 'status', 'bytes', 'cache', 'dns', 'connect',
+            'ttfb', 'total', 'attempts', 'hedged'))
+
+    def __str__(self):
+        notes = []
+        if self.attempts > 1:
+            notes.append('%d attempts' % self.attempts)
+        if self.hedged:
+            notes.append('hedged')
+        if self.cache is not None:
+            notes.append('cache %s' % self.cache)
+        return '%s %s: %s in %.3f s%s' % (
+            self.method, self.url, self.status, self.total,
+            ' (%s)' % ', '.join(notes) if notes else '')
+
+
+# The RequestTrace of the request being sent by each thread, if tracing
+tracing = threading.local()
+
+
+def get_traced_pool_classes():
+    """urllib3 connection pool classes, by scheme, whose connections time
+    DNS lookups and connecting, into tracing.trace
+
+    The host is looked up ahead of connecting, to time it on its own, and
+    like urllib3 does, each of its addresses is tried in turn.
+    """
+    import socket
+    from urllib3 import connection, connectionpool, exceptions
+    from urllib3.util.connection import allowed_gai_family
+
+    class TracedConnectionMixin(object):
+        dns_seconds = None
+
+        def connect(self):
+            trace = getattr(tracing, 'trace', None)
+            started = time.time()
+            super(TracedConnectionMixin, self).connect()
+            if trace is not None:
+                trace.dns = self.dns_seconds
+                trace.connect = time.time() - started - \
+                    (self.dns_seconds or 0)
+
+        def _new_conn(self):
+            started = time.time()
+            host = self._dns_host
+            try:
+                addresses = [info[4][0] for info in socket.getaddrinfo(
+                    host, self.port, allowed_gai_family(),
+                    socket.SOCK_STREAM)]
+            except socket.gaierror:
+                addresses = [host]  # For urllib3 to fail on, as usual
+            self.dns_seconds = time.time() - started
+            try:
+                for address in addresses[:-1]:
+                    self._dns_host = address
+                    try:
+                        return super(TracedConnectionMixin, self)._new_conn()
+                    except (exceptions.NewConnectionError,
+                            exceptions.ConnectTimeoutError):
+                        pass
+                self._dns_host = addresses[-1]
+                return super(TracedConnectionMixin, self)._new_conn()
+            finally:
+                self._dns_host = host
+
+    class TracedHTTPConnection(TracedConnectionMixin,
+                               connection.HTTPConnection):
+        pass
+
+    class TracedHTTPSConnection(TracedConnectionMixin,
+                                connection.HTTPSConnection):
+        pass
+
+    class TracedHTTPConnectionPool(connectionpool.HTTPConnectionPool):
+        ConnectionCls = TracedHTTPConnection
+
+    class TracedHTTPSConnectionPool(connectionpool.HTTPSConnectionPool):
+        ConnectionCls = TracedHTTPSConnection
+
+    return {'http': TracedHTTPConnectionPool,
+            'https': TracedHTTPSConnectionPool}
+
+
+def get_limits_path():
+    return os.path.join(os.path.dirname(get_cache_path()), 'limits')
+
+
+class RateLimiter(object):
+    """Token bucket of rate requests per second, and cap of max_in_flight
+    requests sent at once
+
+    Up to rate requests (at least one) can be sent in a burst after a
+    quiet spell. Either limit can be None, for none. With shared_path,
+    the limits are shared by all processes that use the same directory,
+    with the bucket kept in a file locked with fcntl.flock, and a locked
+    file for each request in flight; locks go away with their process,
+    so one that dies can't leak its share.
+    """
+
+    # How long to wait before trying again when all slots are taken
+    poll_interval = 0.005
+
+    def __init__(self, rate=None, max_in_flight=None, shared_path=None):
+        self.rate = rate
+        self.max_in_flight = max_in_flight
+        self.lock = threading.Lock()
+        self.tokens = self.burst = max(rate or 0, 1)
+        self.updated = time.time()
+        self.free_slots = list(range(max_in_flight or 0))
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.shared_path = shared_path
+        if shared_path is not None:
+            import fcntl
+            self.fcntl = fcntl
+            try:
+                os.makedirs(shared_path)
+            except OSError:
+                pass
+            self.bucket_fd = os.open(os.path.join(shared_path, 'bucket'),
+                                     os.O_RDWR | os.O_CREAT, 0o600)
+            self.slot_fds = [
+                os.open(os.path.join(shared_path, 'in_flight.%d' % slot),
+                        os.O_RDWR | os.O_CREAT, 0o600)
+                for slot in self.free_slots]
+
+    def try_acquire(self):
+        """Take a slot and a token for a request, if both are free
+
+        Returns (slot, 0) if the request can be sent now; it must then be
+        released with the slot once done. Otherwise returns (None, the
+        seconds to wait before trying again).
+        """
+        with self.lock:
+            slot = None
+            if self.max_in_flight is not None:
+                slot = self.take_slot()
+                if slot is None:
+                    return None, self.poll_interval
+            if self.rate is not None:
+                delay = self.take_token()
+                if delay:
+                    if slot is not None:
+                        self.put_slot(slot)
+                    return None, delay
+            return slot, 0
+
+    def take_slot(self):
+        for slot in self.free_slots:
+            if self.shared_path is not None:
+                try:
+                    self.fcntl.flock(self.slot_fds[slot],
+                                     self.fcntl.LOCK_EX | self.fcntl.LOCK_NB)
+                except (IOError, OSError) as e:
+                    if e.errno not in (errno.EAGAIN, errno.EACCES):
+                        raise
+                    continue
+            self.free_slots.remove(slot)
+            return slot
+        return None
+
+    def put_slot(self, slot):
+        if self.shared_path is not None:
+            self.fcntl.flock(self.slot_fds[slot], self.fcntl.LOCK_UN)
+        self.free_slots.append(slot)
+
+    def take_token(self):
+        """Take a token from the bucket, or return the seconds until one"""
+        if self.shared_path is None:
+            self.tokens, self.updated, delay = self.refill(
+                self.tokens, self.updated)
+            return delay
+        fd = self.bucket_fd
+        self.fcntl.flock(fd, self.fcntl.LOCK_EX)
+        try:
+            try:
+                os.lseek(fd, 0, os.SEEK_SET)
+                tokens, updated = map(float, os.read(fd, 64).split())
+            except ValueError:
+                tokens, updated = self.burst, time.time()
+            tokens, updated, delay = self.refill(tokens, updated)
+            data = ('%r %r' % (tokens, updated)).encode('ascii')
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.write(fd, data)
+            os.ftruncate(fd, len(data))
+        finally:
+            self.fcntl.flock(fd, self.fcntl.LOCK_UN)
+        return delay
+
+    def refill(self, tokens, updated):
+        """Returns tokens and updated after taking a token, and 0, or as
+        they were and the seconds until there is one"""
+        now = time.time()
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens >= 1:
+            return tokens - 1, now, 0
+        return tokens, now, (1 - tokens) / self.rate
+
+    def acquire(self):
+        """Wait for, and take, a slot and a token; returns the slot"""
+        started = None
+        while True:
+            slot, delay = self.try_acquire()
+            if not delay:
+                if started is not None:
+                    self.add_wait(time.time() - started)
+                return slot
+            if started is None:
+                started = time.time()
+            time.sleep(delay)
+
+    def add_wait(self, seconds):
+        with self.lock:
+            self.waits += 1
+            self.wait_seconds += seconds
+
+    def release(self, slot):
+        if slot is not None:
+            with self.lock:
+                self.put_slot(slot)
+
+    @contextlib.contextmanager
+    def limit(self):
+        """Hold a slot and a token of the limiter for the duration"""
+        slot = self.acquire()
+        try:
+            yield
+        finally:
+            self.release(slot)
+
+    def close(self):
+        if self.shared_path is not None:
+            for fd in [self.bucket_fd] + self.slot_fds:
+                os.close(fd)
+            self.shared_path = None
+
+
+class TeamCitySession(object):
+    """Wraps the requests.Session that the TeamCity client sends all its
+    requests through
+
+    Connections are kept alive and pooled, with up to pool_size of them
+    open to the server at once. GET responses are served from cache, if
+    given, for as long as cache_ttls allows. With refresh, cached responses
+    are not used but fresh ones are still stored. Requests that aren't
+    served from cache go through a RateLimiter, if rate_limit or
+    max_in_flight is given, shared with other processes with shared_limits.
+
+    GETs that fail with a connection error or one of retry_statuses are
+    retried up to retries times, see get_retry_delay. With hedge_after,
+    a duplicate of a GET is sent if there is no response to it after that
+    many seconds, and the first response of the two is used. A
+    RequestTrace of each request is kept in traces; with trace, they
+    include how long DNS lookups and connecting took.
+    """
+
+    def __init__(self, cache=None, refresh=False,
+                 pool_size=default_pool_size, timeout=default_timeout,
+                 rate_limit=None, max_in_flight=None, shared_limits=False,
+                 retries=default_retries, hedge_after=None, trace=False):
+        import requests
+        self.session = requests.Session()
+        # Block rather than open throwaway connections when all of them
+        # are in use, so that pool_size also caps the load on the server
+        adapter = requests.adapters.HTTPAdapter(
+            pool_maxsize=pool_size, pool_block=True)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if trace:
+            adapter.poolmanager.pool_classes_by_scheme = \
+                get_traced_pool_classes()
+        self.trace = trace
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.cache = cache
+        self.refresh = refresh
+        self.local = threading.local()
+        self.retries = retries
+        self.hedge_after = hedge_after
+        self.traces = collections.deque(maxlen=max_traces)
+        self.limiter = None
+        if rate_limit is not None or max_in_flight is not None:
+            self.limiter = RateLimiter(
+                rate_limit, max_in_flight,
+                get_limits_path() if shared_limits else None)
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    def get_connection_stats(self):
+        """Count connections opened and requests sent over them"""
+        stats = {'connections': 0, 'requests': 0}
+        # The same adapter is mounted for both http:// and https://
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                stats['connections'] += pool.num_connections
+                stats['requests'] += pool.num_requests
+        return stats
+
+    @contextlib.contextmanager
+    def refreshing(self):
+        """Bypass cached responses for requests made by this thread
+
+        For polling loops, which are waiting for the data to change.
+        """
+        self.local.refresh = True
+        try:
+            yield
+        finally:
+            self.local.refresh = False
+
+    def is_refreshing(self):
+        return self.refresh or getattr(self.local, 'refresh', False)
+
+    def get_cache_key(self, method, url, headers):
+        # Responses depend on who is asking, but don't store credentials
+        auth = hashlib.sha1(
+            headers.get('Authorization', '').encode('utf-8')).hexdigest()
+        return '%s %s %s' % (auth, method, url)
+
+    def get_cache_ttl(self, request, response):
+        from requests.compat import urlparse
+        path = urlparse(request.url).path
+        for pattern, ttl in cache_ttls:
+            if re.search(pattern, path):
+                break
+        else:
+            return 0
+        # Only these don't change once the build has finished; its tags,
+        # pin and comment can still be edited
+        match = re.search(r'^(.*/builds/id:[^/]+)'
+                          r'(/(statistics|resulting-properties))?$', path)
+        if match and ttl is not None:
+            if match.group(2) is None:
+                build = response
+            else:
+                build = self.get_cached_response(
+                    request.url[:request.url.index(match.group(2))],
+                    request.headers, count=False)
+            try:
+                if build is not None and build.json()['state'] == 'finished':
+                    return None
+            except (ValueError, KeyError):
+                pass
+        return ttl
+
+    def get_cached_response(self, url, headers, request=None, count=True):
+        cached = self.cache.get(self.get_cache_key('GET', url, headers),
+                                count=count)
+        if cached is None:
+            return None
+        import requests
+        response = requests.Response()
+        response.status_code, headers, response._content = cached
+        response.headers = requests.structures.CaseInsensitiveDict(headers)
+        response.encoding = requests.utils.get_encoding_from_headers(
+            response.headers)
+        response.url = url
+        response.request = request
+        response.reason = 'OK'
+        return use_json_backend(response)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        if self.cache is None or request.method != 'GET' or \
+                kwargs.get('stream'):
+            trace = RequestTrace(request.method, request.url)
+            return use_json_backend(
+                self.send_retrying(request, trace, **kwargs))
+
+        trace = RequestTrace(request.method, request.url, cache='refresh')
+        if not self.is_refreshing():
+            trace.cache = 'miss'
+            response = self.get_cached_response(
+                request.url, request.headers, request)
+            if response is not None:
+                trace.cache = 'hit'
+                trace.finish(response.status_code, response)
+                self.traces.append(trace)
+                return response
+
+        response = use_json_backend(
+            self.send_retrying(request, trace, **kwargs))
+        self.cache_response(request, response)
+        return response
+
+    def cache_response(self, request, response):
+        """Store the response to the GET request, for as long as
+        get_cache_ttl allows"""
+        if response.status_code != 200:
+            return
+        ttl = self.get_cache_ttl(request, response)
+        if ttl != 0:
+            self.cache.set(
+                self.get_cache_key('GET', request.url, request.headers),
+                ttl, response.status_code, response.headers,
+                response.content)
+
+    def send_retrying(self, request, trace, **kwargs):
+        """Send request, retrying and hedging GETs, and keep its trace"""
+        import requests
+        retries = self.retries if request.method == 'GET' else 0
+        hedge = self.hedge_after is not None and \
+            request.method == 'GET' and not kwargs.get('stream')
+        attempt = 0
+        while True:
+            trace.attempts = attempt + 1
+            response = None
+            try:
+                if hedge:
+                    response, hedged = self.send_hedged(request, trace,
+                                                        **kwargs)
+                    trace.hedged = trace.hedged or hedged
+                else:
+                    response = self.send_limited(request, trace, **kwargs)
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout) as e:
+                if attempt >= retries:
+                    trace.finish(e.__class__.__name__)
+                    self.traces.append(trace)
+                    if isinstance(e, requests.exceptions.ConnectionError):
+                        raise
+                    # pyteamcity only hands connection errors to
+                    # error_handler; read timeouts would be a traceback
+                    raise RequestError(str(e))
+            else:
+                if attempt >= retries or \
+                        response.status_code not in retry_statuses:
+                    trace.finish(response.status_code, response)
+                    self.traces.append(trace)
+                    return response
+                response.close()
+            time.sleep(get_retry_delay(attempt, response))
+            attempt += 1
+
+    def send_hedged(self, request, trace, **kwargs):
+        """Send request, and a duplicate of it if there is no response
+        within hedge_after seconds
+
+        Returns the first response, and whether a duplicate was sent. An
+        error is only raised if both requests fail.
+        """
+        try:
+            import queue
+        except ImportError:
+            import Queue as queue
+        results = queue.Queue()
+
+        def send():
+            try:
+                results.put((self.send_limited(request.copy(), trace,
+                                               **kwargs), None))
+            except Exception as e:
+                results.put((None, e))
+
+        def start():
+            thread = threading.Thread(target=send)
+            thread.daemon = True
+            thread.start()
+
+        start()
+        try:
+            response, error = results.get(timeout=self.hedge_after)
+            hedged = False
+        except queue.Empty:
+            start()
+            hedged = True
+            response, error = results.get()
+            if error is not None:
+                response, error = results.get()
+        if error is not None:
+            raise error
+        return response, hedged
+
+    def send_limited(self, request, trace, **kwargs):
+        """Send request to the server, within the limits of the limiter
+
+        A streamed response counts as in flight until its headers arrive,
+        not until its body has been read.
+        """
+        if self.limiter is None:
+            return self.send_traced(request, trace, **kwargs)
+        with self.limiter.limit():
+            return self.send_traced(request, trace, **kwargs)
+
+    def send_traced(self, request, trace, **kwargs):
+        if self.trace:
+            tracing.trace = trace
+        try:
+            sent_at = time.time()
+            response = self.session.send(request, **kwargs)
+            response.sent_at = sent_at
+            return response
+        finally:
+            tracing.trace = None
+
+    def close(self):
+        self.session.close()
+        if self.limiter is not None:
+            self.limiter.close()
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+
+
+class LazyTeamCity(object):
+    """Stand-in for the TeamCity client that creates it when first used
+
+    Importing pyteamcity, and requests with it, takes most of the startup
+    time, which `--help` shouldn't have to pay. With cache, responses are
+    cached on disk. With backend 'async', the client is wrapped in an
+    AsyncTeamCity, see teamcitycli_async. session_kwargs are passed on to
+    TeamCitySession.
+    """
+
+    def __init__(self, cache=True, backend='sync', **session_kwargs):
+        self.cache = cache
+        self.backend = backend
+        self.session_kwargs = session_kwargs
+        self.teamcity = None
+
+    def __getattr__(self, name):
+        if self.teamcity is None:
+            from pyteamcity import TeamCity
+            cache = open_response_cache() if self.cache else None
+            session = TeamCitySession(cache=cache, **self.session_kwargs)
+            teamcity = TeamCity(session=session)
+            teamcity.error_handler = error_handler
+            if self.backend == 'async':
+                from teamcitycli_async import AsyncTeamCity
+                teamcity = AsyncTeamCity(teamcity,
+                                         pool_size=session.pool_size,
+                                         timeout=session.timeout)
+            self.teamcity = teamcity
+        return getattr(self.teamcity, name)
+
+    def close(self):
+        if self.teamcity is None:
+            return
+        if self.backend == 'async':
+            self.teamcity.close()
+        else:
+            self.teamcity.session.close()
+
+
+def get_triggered_user(item):
+    triggered = item['triggered']
+    return triggered.get('user', {}).get('username', 'N/A')
+
+
+def get_agent_build_type(agent):
+    build_type = agent['build']['buildType']
+    return '%s :: %s' % (build_type['projectName'], build_type['name'])
+
+
+def get_agent_build_text(agent):
+    return agent['build'].get('statusText', 'N/A')
+
+
+class Column(object):
+    """How a table command fills in one of its columns
+
+    The column is preferably selected in the listing request itself with
+    the `fields=` expression `fields`, and read from each listed item with
+    `value`. Otherwise it is read with `source_value` from the response to
+    the extra request named `source`. `default` is the value for items
+    that lack the field although the server honoured `fields=`.
+    """
+
+    def __init__(self, fields=None, value=None, source=None,
+                 source_value=None, default=None):
+        self.fields = fields
+        self.value = value
+        self.source = source
+        self.source_value = source_value or value
+        self.default = default
+
+
+def field(name):
+    """Column for the item field called name"""
+    return Column(fields=name, value=lambda item: item[name])
+
+
+class Table(object):
+    """The columns that a table command knows how to fill in
+
+    `sources` maps the name of each extra request to a function making it
+    for an item. Columns without a source of their own, and columns that
+    aren't in `columns` at all, come from `default_source`. `probe` is a
+    field that is always present in a response that honoured `fields=`.
+    """
+
+    def __init__(self, item_name, columns, sources, default_source,
+                 required=('id',), probe=None):
+        self.item_name = item_name
+        self.columns = columns
+        self.sources = sources
+        self.default_source = default_source
+        self.required = required
+        self.probe = probe
+
+    def get_column(self, column_name):
+        column = self.columns.get(column_name)
+        if column is None:
+            column = Column(
+                source_value=lambda response: response[column_name])
+        if column.source is None:
+            column.source = self.default_source
+        return column
+
+    def get_fields_expression(self, column_names):
+        """Build the `fields=` expression that selects column_names"""
+        selected = []
+        for column_name in list(self.required) + column_names:
+            fields = self.get_column(column_name).fields
+            if fields and fields not in selected:
+                selected.append(fields)
+        return 'count,%s(%s)' % (self.item_name, ','.join(selected))
+
+    def get_missing_columns(self, item, column_names):
+        """Set the column_names that item has the data for in item
+
+        Returns (column_name, column) for the others.
+        """
+        missing = []
+        for column_name in column_names:
+            column = self.get_column(column_name)
+            if column.value is not None:
+                try:
+                    item[column_name] = column.value(item)
+                    continue
+                except (KeyError, TypeError):
+                    pass
+            if column.default is not None and self.probe in item:
+                item[column_name] = column.default
+            else:
+                missing.append((column_name, column))
+        return missing
+
+    def iter_fill(self, client, items, column_names, concurrency):
+        """Set column_names in each of items, yielding items when done
+
+        Items are yielded in order, as soon as they and the ones before
+        them are done. Extra requests are only made for the columns that
+        the listing didn't return, in parallel across items.
+        """
+        def get_responses(client, entry):
+            item, missing = entry
+            responses = {}
+            for column_name, column in missing:
+                if column.source not in responses:
+                    source = self.sources[column.source]
+                    responses[column.source] = source(client, item)
+            return responses
+
+        entries = ((item, self.get_missing_columns(item, column_names))
+                   for item in items)
+        results = fan_out(client, get_responses, entries, concurrency)
+        for (item, missing), responses, error in results:
+            if error is not None:
+                sys.stderr.write('ERROR: %s %s: %s\n' % (
+                    self.item_name, item['id'], error))
+                yield item
+                continue
+            for column_name, column in missing:
+                try:
+                    item[column_name] = column.source_value(
+                        responses[column.source])
+                except KeyError:
+                    pass
+            yield item
+
+    def fill(self, client, items, column_names, concurrency):
+        """Set column_names in each of items"""
+        for _ in self.iter_fill(client, items, column_names, concurrency):
+            pass
+
+
+build_table = Table(
+    'build',
+    columns=dict(
+        [(name, field(name))
+         for name in ('id', 'buildTypeId', 'number', 'status', 'state',
+                      'statusText', 'branchName', 'defaultBranch',
+                      'running', 'percentageComplete', 'href', 'webUrl',
+                      'queuedDate', 'startDate', 'finishDate')],
+        user=Column(fields='triggered(type,user(username))',
+                    value=get_triggered_user),
+        details=Column(source_value=lambda details: details)),
+    sources={
+        'details': lambda client, build:
+            client.get_build_by_build_id(build['id']),
+    },
+    default_source='details',
+    required=('id', 'state'))
+
+queued_build_table = Table(
+    'build',
+    columns=dict(
+        [(name, field(name))
+         for name in ('id', 'buildTypeId', 'state', 'branchName', 'href',
+                      'webUrl', 'queuedDate', 'startEstimate',
+                      'waitReason')],
+        user=Column(fields='triggered(type,user(username))',
+                    value=get_triggered_user)),
+    sources={
+        'details': lambda client, build:
+            client.get_queued_build_by_build_id(build['id']),
+    },
+    default_source='details',
+    required=('id', 'state'))
+
+# The running build's fields stand in for the build_type and build_text
+# that pyteamcity scrapes from agentDetails.html, one page per agent
+agent_build_fields = 'build(buildType(name,projectName),statusText)'
+
+agent_table = Table(
+    'agent',
+    columns=dict(
+        [(name, field(name))
+         for name in ('id', 'name', 'typeId', 'href', 'webUrl', 'connected',
+                      'enabled', 'authorized', 'uptodate', 'ip')],
+        pool=Column(fields='pool(name)',
+                    value=lambda agent: agent['pool']['name']),
+        build_type=Column(fields=agent_build_fields,
+                          value=get_agent_build_type,
+                          source='agent_details',
+                          source_value=lambda data: data['build_type'],
+                          default='Idle'),
+        build_text=Column(fields=agent_build_fields,
+                          value=get_agent_build_text,
+                          source='agent_details',
+                          source_value=lambda data: data['build_text'],
+                          default='Idle')),
+    sources={
+        'agent': lambda client, agent:
+            client.get_agent_by_agent_id(agent['id']),
+        # build_type and build_text both come from the agentDetails.html
+        # page, which pyteamcity scrapes and caches per agent
+        'agent_details': lambda client, agent:
+            client._fetch_agent_details(agent['id']),
+    },
+    default_source='agent',
+    required=('id', 'name', 'connected'),
+    probe='connected')
 
 
 @click.group()
+@click.option('--cache/--no-cache', default=True,
+              help='Use the on-disk cache of server responses')
+@click.option('--refresh', is_flag=True, default=False,
+              help='Ignore cached responses but store fresh ones')
+@click.option('--pool-size', default=default_pool_size,
+              type=click.IntRange(1, None),
+              help='Max number of connections to the server')
+@click.option('--timeout', default=default_timeout, type=float,
+              help='Seconds to wait for the server to connect or respond')
+@click.option('--debug', is_flag=True, default=False,
+              help='Print the timing of each request, and connection '
+                   'statistics, to stderr on exit')
+@click.option('--color/--no-color', default=None,
+              help='Color output (default: only if stdout is a terminal)')
+@click.option('--compact', is_flag=True, default=False,
+              help='Write JSON output on a single line, without indentation')
+@click.option('--rate-limit', default=None,
+              type=click.FloatRange(0.01, None),
+              envvar='TEAMCITY_CLI_RATE_LIMIT',
+              help='Max number of requests per second to the server '
+                   '[env: TEAMCITY_CLI_RATE_LIMIT]')
+@click.option('--max-in-flight', default=None, type=click.IntRange(1, None),
+              envvar='TEAMCITY_CLI_MAX_IN_FLIGHT',
+              help='Max number of requests to the server at once '
+                   '[env: TEAMCITY_CLI_MAX_IN_FLIGHT]')
+@click.option('--shared-limits/--no-shared-limits', default=False,
+              envvar='TEAMCITY_CLI_SHARED_LIMITS',
+              help='Share --rate-limit and --max-in-flight with the other '
+                   'teamcity processes of this user on this host '
+                   '[env: TEAMCITY_CLI_SHARED_LIMITS]')
+@click.option('--retries', default=default_retries,
+              type=click.IntRange(0, None),
+              help='Times to retry GETs that fail with a connection error '
+                   'or a 429, 502, 503 or 504 response')
+@click.option('--hedge-after', default=None, type=float,
+              help='Seconds after which a duplicate of a GET that has no '
+                   'response yet is sent, using whichever response is first')
+@click.option('--trace', is_flag=True, default=False,
+              help='Time DNS lookups, connecting and the first byte of '
+                   'responses, and print how long requests took, by '
+                   'endpoint, to stderr on exit')
+@click.option('--trace-file', default=None,
+              type=click.Path(dir_okay=False, writable=True),
+              help='Write the requests made to a Chrome trace-event JSON '
+                   'file, for chrome://tracing; implies --trace')
+@click.option('--backend', default='sync',
+              type=click.Choice(['sync', 'async']),
+              help='Make parallel requests from threads, or as coroutines '
+                   '(needs httpx)')
 @click.pass_context
-def cli(ctx):
+def cli(ctx, cache, refresh, pool_size, timeout, debug, color, compact,
+        rate_limit, max_in_flight, shared_limits, retries, hedge_after,
+        trace, trace_file, backend):
     """CLI for interacting with TeamCity"""
-    ctx.obj = TeamCity()
-    ctx.obj.error_handler = error_handler
+    ctx.color = color
+    ctx.meta['teamcity.compact_json'] = compact
+    if ctx.invoked_subcommand in ('cache', 'daemon'):
+        return
+    session_kwargs = {'refresh': refresh, 'pool_size': pool_size,
+                      'timeout': timeout, 'rate_limit': rate_limit,
+                      'max_in_flight': max_in_flight,
+                      'shared_limits': shared_limits, 'retries': retries,
+                      'hedge_after': hedge_after,
+                      'trace': trace or trace_file is not None}
+    if warm_clients is None:
+        ctx.obj = LazyTeamCity(cache=cache, backend=backend,
+                               **session_kwargs)
+        ctx.call_on_close(ctx.obj.close)
+    else:
+        from teamcitycli_client import get_teamcity_env
+        key = (cache, backend, tuple(sorted(session_kwargs.items())),
+               tuple(sorted(get_teamcity_env().items())))
+        if key not in warm_clients:
+            warm_clients[key] = LazyTeamCity(cache=cache, backend=backend,
+                                             **session_kwargs)
+        ctx.obj = warm_clients[key]
+        # pyteamcity keeps the agents it got forever; only ResponseCache
+        # knows how long they stay fresh
+        if ctx.obj.teamcity is not None:
+            ctx.obj._agent_cache.clear()
+    if debug or session_kwargs['trace']:
+        ctx.call_on_close(functools.partial(
+            output_reports, ctx.obj, debug=debug,
+            trace=session_kwargs['trace'], trace_file=trace_file))
 
 
 @cli.group()
@@ -72,19 +1811,215 @@ def user():
     """Commands related to users"""
 
 
+@cli.group()
+def cache():
+    """Commands related to the on-disk response cache"""
+
+
 @server.command(name='info')
 @click.pass_context
-def server_info(ctx):
+@click.option('--output-format', default='json',
+              type=click.Choice(json_output_formats),
+              help='Output format')
+def server_info(ctx, output_format):
     """Display info about TeamCity server"""
     data = ctx.obj.get_server_info()
-    output_json_data(data)
+    output_json_data(data, output_format)
+
+
+@cache.command(name='stats')
+@click.option('--output-format', default='json',
+              type=click.Choice(json_output_formats),
+              help='Output format')
+def cache_stats(output_format):
+    """Display statistics for the response cache"""
+    response_cache = ResponseCache(get_cache_path())
+    try:
+        output_json_data(response_cache.stats(), output_format)
+    finally:
+        response_cache.close()
+
+
+@cache.command(name='clear')
+@click.option('--expired', is_flag=True, default=False,
+              help='Only delete expired responses')
+def cache_clear(expired):
+    """Delete responses from the cache"""
+    response_cache = ResponseCache(get_cache_path())
+    try:
+        count = response_cache.clear(expired_only=expired)
+    finally:
+        response_cache.close()
+    click.echo('deleted: %d' % count)
+
+
+# Errors writing to a teamcity-client that has gone away
+client_gone_errnos = (errno.EPIPE, errno.ECONNRESET)
+
+
+class DaemonStream(io.RawIOBase):
+    """Stream that writes to a teamcity-client as frames on channel"""
+
+    def __init__(self, conn, channel, tty):
+        self.conn = conn
+        self.channel = channel
+        self.tty = tty
+
+    def writable(self):
+        return True
+
+    def isatty(self):
+        return self.tty
+
+    def write(self, data):
+        from teamcitycli_client import write_frame
+        data = bytes(data)
+        write_frame(self.conn, self.channel, data)
+        return len(data)
+
+
+def run_daemon_command(conn):
+    """Run the command that a teamcity-client sent on conn
+
+    Its output is sent back over conn as it is written, then its exit
+    status. The client's working directory and TEAMCITY_* environment
+    variables are used while it runs.
+    """
+    import traceback
+    from teamcitycli_client import EXIT, STDOUT, STDERR, write_frame
+    request = json.loads(conn.makefile('rb').readline().decode('utf-8'))
+
+    streams = dict(
+        (channel, io.TextIOWrapper(
+            io.BufferedWriter(DaemonStream(conn, channel, tty)),
+            encoding='utf-8', errors='replace', line_buffering=tty))
+        for channel, tty in [(STDOUT, request['tty']['stdout']),
+                             (STDERR, request['tty']['stderr'])])
+    saved = sys.stdin, sys.stdout, sys.stderr, os.getcwd(), dict(os.environ)
+    devnull = open(os.devnull)
+    status = 0
+    try:
+        sys.stdin = devnull
+        sys.stdout, sys.stderr = streams[STDOUT], streams[STDERR]
+        for name in list(os.environ):
+            if name.startswith('TEAMCITY_'):
+                del os.environ[name]
+        os.environ.update(request['env'])
+        try:
+            os.chdir(request['cwd'])
+            cli.main(args=request['argv'], prog_name='teamcity')
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                status = e.code or 0
+            else:
+                sys.stderr.write('%s\n' % e.code)
+                status = 1
+        except Exception as e:
+            if getattr(e, 'errno', None) in client_gone_errnos:
+                return
+            traceback.print_exc()
+            status = 1
+        for stream in streams.values():
+            stream.flush()
+        write_frame(conn, EXIT, str(status).encode('ascii'))
+    except EnvironmentError as e:
+        if e.errno not in client_gone_errnos:
+            raise
+    finally:
+        devnull.close()
+        sys.stdin, sys.stdout, sys.stderr = saved[:3]
+        os.chdir(saved[3])
+        os.environ.clear()
+        os.environ.update(saved[4])
+        for stream in streams.values():
+            try:
+                stream.close()
+            except EnvironmentError:
+                pass
+
+
+@cli.command(name='daemon')
+@click.option('--socket', 'socket_path', default=None,
+              help='Unix socket to listen on (default: $TEAMCITY_CLI_SOCKET, '
+                   'or teamcity_cli.sock in $XDG_RUNTIME_DIR, or in a '
+                   'private directory in /tmp)')
+@click.option('--idle-timeout', default=None, type=float,
+              help='Exit after this many seconds without a command')
+def daemon(socket_path, idle_timeout):
+    """Run commands for teamcity-client, keeping clients warm
+
+    Commands sent by teamcity-client run one at a time in this process,
+    which keeps the connections to the server and the response cache
+    open between them.
+    """
+    global warm_clients
+    import signal
+    import socket
+    from teamcitycli_client import check_socket_dir, get_socket_path
+    if socket_path is None:
+        socket_path = get_socket_path()
+    socket_dir = os.path.dirname(os.path.abspath(socket_path))
+    if not os.path.exists(socket_dir):
+        os.makedirs(socket_dir, 0o700)
+    problem = check_socket_dir(socket_dir)
+    if problem is not None:
+        raise click.ClickException(problem)
+
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except socket.error:
+        # Not running; remove the socket that a dead daemon left behind
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+    else:
+        raise click.ClickException(
+            'a daemon is already listening on %s' % socket_path)
+    finally:
+        probe.close()
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # The environment that clients send can include TEAMCITY_PASSWORD
+    umask = os.umask(0o077)
+    try:
+        server.bind(socket_path)
+    finally:
+        os.umask(umask)
+    server.listen(16)
+    server.settimeout(idle_timeout)
+    warm_clients = {}
+    # Clean up when stopped with kill
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    sys.stderr.write('listening on %s\n' % socket_path)
+    try:
+        while True:
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                break
+            conn.settimeout(None)
+            try:
+                run_daemon_command(conn)
+            except Exception:
+                import traceback
+                traceback.print_exc()
+            finally:
+                conn.close()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        os.unlink(socket_path)
+        for client in warm_clients.values():
+            client.close()
+        warm_clients = None
 
 
 @project.command(name='list')
 @click.option('--parent-project-id', default=None,
               help='parent_project_id to filter on')
 @click.option('--output-format', default='table',
-              type=click.Choice(['table', 'json']),
+              type=click.Choice(output_formats),
               help='Output format')
 @click.option('--columns', default=default_project_list_columns,
               help='comma-separated list of columns to show in table')
@@ -92,21 +2027,32 @@ def server_info(ctx):
 def project_list(ctx, parent_project_id, output_format, columns):
     """Display list of projects"""
     data = ctx.obj.get_projects(parent_project_id=parent_project_id)
-    if output_format == 'table':
+    if output_format in ('table', 'stream-table'):
         column_names = columns.split(',')
-        output_table(column_names, data['project'])
+        output_table(column_names, data['project'],
+                     stream=output_format == 'stream-table')
     elif output_format == 'json':
         output_json_data(data)
+    elif output_format == 'ndjson':
+        output_ndjson(data['project'])
 
 
 @project.command(name='show')
 @click.pass_context
 @click.argument('args', nargs=-1)
-def project_show(ctx, args):
+@click.option('--output-format', default='json',
+              type=click.Choice(json_output_formats),
+              help='Output format')
+@click.option('--concurrency', default=default_concurrency,
+              type=click.IntRange(1, None),
+              help='Max number of projects to fetch in parallel')
+@click.option('--ids-from', type=click.File('r'), default=None,
+              help='file ("-" for stdin) with more IDs, one per line')
+def project_show(ctx, output_format, concurrency, ids_from, args):
     """Display info for selected projects"""
-    for project_id in args:
-        data = ctx.obj.get_project_by_project_id(project_id)
-        output_json_data(data)
+    show_each(ctx.obj.get_project_by_project_id, iter_ids(args, ids_from),
+              lambda data: output_json_data(data, output_format),
+              'project', concurrency)
 
 
 @build.command(name='list')
@@ -115,7 +2061,13 @@ def project_show(ctx, args):
 @click.option('--show-data/--no-show-data', default=True,
               help='Show data retrieved from request')
 @click.option('--start', default=0, help='Start index')
-@click.option('--count', default=100, help='Max number of items to show')
+@click.option('--count', default=100,
+              help='Max number of items to show, or per page with '
+                   '--all/--limit')
+@click.option('--all', 'fetch_all', is_flag=True, default=False,
+              help='Show all builds, following pages to the last one')
+@click.option('--limit', default=None, type=click.IntRange(1, None),
+              help='Show up to this many builds, fetching pages in parallel')
 @click.option('--project', default=None, help='project to filter on')
 @click.option('--build-type-id', default=None, help='buildTypeId to filter on')
 @click.option('--branch', default='default:any', help='branch to filter on')
@@ -131,15 +2083,19 @@ def project_show(ctx, args):
               help='limit builds to only those triggered '
                    'by the user specified')
 @click.option('--output-format', default='table',
-              type=click.Choice(['table', 'json']),
+              type=click.Choice(output_formats),
               help='Output format')
 @click.option('--columns', default=default_build_list_columns,
               help='comma-separated list of columns to show in table')
+@click.option('--concurrency', default=default_concurrency,
+              type=click.IntRange(1, None),
+              help='Max number of pages or build details to fetch '
+                   'in parallel')
 @click.pass_context
 def build_list(ctx, show_url, show_data,
-               start, count,
+               start, count, fetch_all, limit,
                project, build_type_id, branch, status, running, tags, user,
-               output_format, columns):
+               output_format, columns, concurrency):
     """Display list of builds"""
     kwargs = {'start': start,
               'count': count}
@@ -159,6 +2115,18 @@ def build_list(ctx, show_url, show_data,
         kwargs['project'] = project
 
     func = ctx.obj.get_builds
+    paged = fetch_all or limit is not None
+
+    if output_format in ('table', 'stream-table'):
+        column_names = columns.split(',')
+        # Ask for the columns inline so that, as far as possible, a single
+        # request fills the whole table
+        fields = build_table.get_fields_expression(column_names)
+        if paged:
+            fields = 'nextHref,' + fields
+        func = functools.partial(get_with_fields, func, fields)
+    else:
+        column_names = ['user', 'statusText', 'details']
 
     if show_url:
         kwargs['return_type'] = 'url'
@@ -169,8 +2137,28 @@ def build_list(ctx, show_url, show_data,
     if not show_data:
         return
 
+    from pyteamcity import HTTPError
     try:
-        data = func(**kwargs)
+        if paged:
+            builds = iter_pages(ctx.obj, func, 'build', limit=limit,
+                                concurrency=concurrency, **kwargs)
+        else:
+            data = func(**kwargs)
+            if output_format != 'ndjson':
+                click.echo('count: %d' % data['count'])
+            if data['count'] == 0:
+                return
+            builds = data['build']
+
+        builds = build_table.iter_fill(ctx.obj, builds, column_names,
+                                       concurrency)
+        if output_format == 'stream-table':
+            output_table(column_names, builds, stream=True)
+            return
+        elif output_format == 'ndjson':
+            output_ndjson(builds)
+            return
+        builds = list(builds)
     except HTTPError as e:
         click.echo('url: %s' % e.url)
         click.echo('status_code: %s' % e.status_code)
@@ -178,30 +2166,29 @@ def build_list(ctx, show_url, show_data,
         click.echo(e)
         return
 
-    for build in data['build']:
-        details = ctx.obj.get_build_by_build_id(build['id'])
-        try:
-            build['user'] = details['triggered']['user']['username']
-            build['statusText'] = details['statusText']
-            build['details'] = details
-        except KeyError:
-            build['user'] = 'N/A'
-
-    click.echo('count: %d' % data['count'])
-    if data['count'] == 0:
-        return
+    if paged:
+        data = {'count': len(builds), 'build': builds}
+        click.echo('count: %d' % data['count'])
+        if data['count'] == 0:
+            return
 
     if output_format == 'table':
-        column_names = columns.split(',')
-        output_table(column_names, data['build'])
+        output_table(column_names, builds)
     elif output_format == 'json':
         output_json_data(data)
 
 
 @build.command(name='trigger')
 @click.pass_context
-@click.option('--build-type-id', default=None, help='buildTypeId to filter on')
-@click.option('--branch', default=None, help='branch to filter on')
+@click.option('--build-type-id', multiple=True,
+              help='buildTypeId to trigger (can be repeated)')
+@click.option('--branch', multiple=True,
+              help='branch to build: one for all build types, including '
+                   'the --from-file lines without a BRANCH, or one per '
+                   '--build-type-id')
+@click.option('--from-file', type=click.File('r'), default=None,
+              help='file ("-" for stdin) with more builds to trigger, '
+                   'one "BUILD_TYPE_ID [BRANCH]" per line')
 @click.option('--comment', help='comment message for build')
 @click.option('--parameter', multiple=True, help='Specify custom parameters')
 @click.option('--agent-id', default=None,
@@ -210,44 +2197,173 @@ def build_list(ctx, show_url, show_data,
               help='open build log in browser')
 @click.option('--wait-for-run/--no-wait-for-run', default=False,
               help='Wait for the build to start running')
-def build_trigger(ctx, build_type_id, branch, comment, parameter, agent_id,
-                  open_build_log, wait_for_run):
-    """Trigger a new build"""
+@click.option('--wait-for-finish/--no-wait-for-finish', default=False,
+              help='Wait for the build to finish; the exit status is 1 '
+                   'if it did not succeed')
+@click.option('--wait-timeout', default=None, type=float,
+              help='Max seconds to wait for the builds; the exit status is '
+                   '124 on timeout')
+@click.option('--concurrency', default=default_concurrency,
+              type=click.IntRange(1, None),
+              help='Max number of builds to trigger or poll in parallel')
+@click.option('--output-format', default='table',
+              type=click.Choice(['table', 'ndjson']),
+              help='Output format')
+def build_trigger(ctx, build_type_id, branch, from_file, comment, parameter,
+                  agent_id, open_build_log, wait_for_run, wait_for_finish,
+                  wait_timeout, concurrency, output_format):
+    """Trigger new build(s)
+
+    The exit status is 1 if any build could not be triggered, could not
+    be waited for or, with --wait-for-finish, did not succeed. Otherwise
+    it is 124 if waiting for any build timed out.
+    """
+    if len(branch) > 1 and len(branch) != len(build_type_id):
+        raise click.UsageError(
+            'Give one --branch, or one per --build-type-id')
+    default_branch = branch[0] if len(branch) == 1 else None
+    if len(branch) > 1:
+        targets = list(zip(build_type_id, branch))
+    else:
+        targets = [(b, default_branch) for b in build_type_id]
+    if from_file is not None:
+        targets.extend((b, line_branch or default_branch)
+                       for b, line_branch
+                       in read_build_type_branches(from_file))
+    if not targets:
+        raise click.UsageError('No --build-type-id given')
+
     parameters = dict([p.split('=', 1) for p in parameter])
-    data = ctx.obj.trigger_build(
-        build_type_id=build_type_id,
-        branch=branch,
-        comment=comment,
-        parameters=parameters,
-        agent_id=agent_id)
-    build_id = data['id']
-    ctx.invoke(build_queue_show, args=[build_id])
+
+    def trigger(target):
+        return ctx.obj.trigger_build(
+            build_type_id=target[0],
+            branch=target[1],
+            comment=comment,
+            parameters=parameters,
+            agent_id=agent_id)
+
+    failed = False
+    builds = []
+    for target, data, error in concurrent_map(trigger, targets, concurrency):
+        if error is not None:
+            sys.stderr.write('ERROR: build type %s: %s\n' % (target[0], error))
+            failed = True
+        else:
+            builds.append(data)
+
+    if output_format == 'ndjson':
+        output_ndjson(builds)
+    elif len(targets) == 1 and builds:
+        ctx.invoke(build_queue_show, args=[builds[0]['id']])
+    elif builds:
+        output_table(['id', 'buildTypeId', 'branchName', 'state', 'webUrl'],
+                     builds)
     if open_build_log:
-        url = data['webUrl'] + '&tab=buildLog'
-        webbrowser.open(url)
-    if not wait_for_run:
+        import webbrowser
+        for data in builds:
+            url = data['webUrl'] + '&tab=buildLog'
+            webbrowser.open(url)
+
+    if wait_for_finish:
+        states = ('finished',)
+    elif wait_for_run:
+        states = ('running', 'finished')
+    else:
+        ctx.exit(1 if failed else 0)
+    build_ids = [data['id'] for data in builds]
+    results, errors = wait_for_builds(ctx.obj, build_ids, states,
+                                      wait_timeout, concurrency=concurrency,
+                                      err=output_format == 'ndjson')
+    for build_id in build_ids:
+        if build_id in errors:
+            sys.stderr.write('ERROR: gave up waiting for build %s: %s\n' % (
+                build_id, errors[build_id]))
+            failed = True
+        elif build_id not in results:
+            sys.stderr.write(
+                'ERROR: timed out waiting for build %s\n' % build_id)
+
+    if wait_for_finish and [data for data in results.values()
+                            if data.get('status') != 'SUCCESS']:
+        failed = True
+    if output_format == 'ndjson':
+        output_ndjson([results[build_id] for build_id in build_ids
+                       if build_id in results])
+    elif len(targets) == 1 and results:
+        if wait_for_finish:
+            ctx.invoke(build_show_details, args=build_ids)
+        else:
+            ctx.invoke(build_queue_show, args=build_ids)
+    elif results:
+        output_table(['id', 'buildTypeId', 'branchName', 'state', 'status'],
+                     [results[build_id] for build_id in build_ids
+                      if build_id in results])
+
+    if failed:
+        ctx.exit(1)
+    if len(results) < len(build_ids):
+        ctx.exit(124)
+
+
+def output_table(column_names, data, stream=False):
+    """Output data as a table
+
+    With stream, rows are printed as data yields them, rather than once
+    all of it is there, see output_stream_table.
+    """
+    rows = (get_table_row(column_names, item) for item in data)
+    if stream:
+        output_stream_table(column_names, rows)
         return
-    while data['state'] == 'queued':
-        data = ctx.obj.get_queued_build_by_build_id(build_id)
-        click.echo('state: %s' % data['state'])
-        time.sleep(1)
-    ctx.invoke(build_queue_show, args=[build_id])
-
-
-def output_table(column_names, data):
     table_data = [column_names]
-    for item in data:
-        if item.get('state') == 'running':
-            item['status'] = 'RUNNING'
-        row = [str(item.get(column_name, 'N/A'))
-               for column_name in column_names]
+    for row in rows:
         colorize_row(row)
         table_data.append(row)
+    import terminaltables
     table = terminaltables.SingleTable(table_data)
     click.echo(table.table)
 
 
+def get_table_row(column_names, item):
+    if item.get('state') == 'running':
+        item['status'] = 'RUNNING'
+    return [str(item.get(column_name, 'N/A'))
+            for column_name in column_names]
+
+
+def output_stream_table(column_names, rows):
+    """Print a table row by row, as rows yields them
+
+    Column widths are set by the first stream_table_window rows. A longer
+    value in a later row widens its column from that row on, rather than
+    being cut short, since it could be an ID.
+    """
+    rows = iter(rows)
+    window = list(itertools.islice(rows, stream_table_window))
+    widths = [max([len(column_name)] + [len(row[idx]) for row in window])
+              for idx, column_name in enumerate(column_names)]
+
+    def format_row(row, colorize=True):
+        row = list(row)
+        widths[:] = [max(len(value), width)
+                     for value, width in zip(row, widths)]
+        if colorize:
+            colorize_row(row)
+        cells = [value.ljust(width) for value, width in zip(row, widths)]
+        return '  '.join(cells).rstrip()
+
+    with exit_on_broken_pipe():
+        click.echo(format_row(column_names, colorize=False))
+        click.echo(format_row(['-' * width for width in widths],
+                              colorize=False))
+        for row in itertools.chain(window, rows):
+            click.echo(format_row(row))
+
+
 def colorize_row(row):
+    if not use_color():
+        return
     for idx, value in enumerate(row):
         if value == 'SUCCESS':
             row[idx] = colorize(value, 'green')
@@ -258,6 +2374,7 @@ def colorize_row(row):
 
 
 def colorize(s, color, auto=True):
+    from colorclass import Color
     tag = '%s%s' % ('auto' if auto else '', color)
     return Color('{%s}%s{/%s}' % (tag, s, tag))
 
@@ -265,11 +2382,19 @@ def colorize(s, color, auto=True):
 @build.command(name='browse')
 @click.pass_context
 @click.argument('args', nargs=-1)
-def build_browse(ctx, args):
+@click.option('--concurrency', default=default_concurrency,
+              type=click.IntRange(1, None),
+              help='Max number of builds to fetch in parallel')
+@click.option('--ids-from', type=click.File('r'), default=None,
+              help='file ("-" for stdin) with more IDs, one per line')
+def build_browse(ctx, concurrency, ids_from, args):
     """Open selected build(s) in web browser"""
-    for build_id in args:
-        data = ctx.obj.get_build_by_build_id(build_id)
-        webbrowser.open(data['webUrl'])
+    import webbrowser
+    show_each(ctx.obj.get_build_by_build_id, iter_ids(args, ids_from),
+              lambda data: webbrowser.open(data['webUrl']),
+              'build', concurrency,
+              get_many=functools.partial(get_items_by_ids, ctx.obj,
+                                         'builds', 'build'))
 
 
 @build.group(name='queue',
@@ -286,7 +2411,7 @@ def build_queue():
 @click.option('--affected-project', default=None, help='project to filter on (recursive)')
 @click.option('--template-flag', default='any', help='boolean value to get only templates or only non-templates')
 @click.option('--output-format', default='table',
-              type=click.Choice(['table', 'json']),
+              type=click.Choice(output_formats),
               help='Output format')
 @click.option('--columns', default=default_build_configs_list_columns,
               help='comma-separated list of columns to show in table')
@@ -309,13 +2434,18 @@ def build_configs_list(ctx, show_url, project, affected_project, template_flag,
 
     data = ctx.obj.get_build_types(**kwargs)
 
+    if output_format == 'ndjson':
+        output_ndjson(data.get('buildType', []))
+        return
+
     click.echo('count: %d' % data['count'])
     if data['count'] == 0:
         return
 
-    if output_format == 'table':
+    if output_format in ('table', 'stream-table'):
         column_names = columns.split(',')
-        output_table(column_names, data['buildType'])
+        output_table(column_names, data['buildType'],
+                     stream=output_format == 'stream-table')
     elif output_format == 'json':
         output_json_data(data)
 
@@ -324,10 +2454,18 @@ def build_configs_list(ctx, show_url, project, affected_project, template_flag,
                        short_help='Show info about a build config')
 @click.pass_context
 @click.argument('args', nargs=-1)
-def build_configs_show(ctx, args):
-    for build_type_id in args:
-        all_data = ctx.obj.get_build_type(build_type_id)
-        output_json_data(all_data)
+@click.option('--output-format', default='json',
+              type=click.Choice(json_output_formats),
+              help='Output format')
+@click.option('--concurrency', default=default_concurrency,
+              type=click.IntRange(1, None),
+              help='Max number of build configs to fetch in parallel')
+@click.option('--ids-from', type=click.File('r'), default=None,
+              help='file ("-" for stdin) with more IDs, one per line')
+def build_configs_show(ctx, output_format, concurrency, ids_from, args):
+    show_each(ctx.obj.get_build_type, iter_ids(args, ids_from),
+              lambda data: output_json_data(data, output_format),
+              'build config', concurrency)
 
 
 @build_queue.command(name='list')
@@ -335,20 +2473,34 @@ def build_configs_show(ctx, args):
 @click.option('--build-type-id', default=None, help='buildTypeId to filter on')
 @click.option('--branch', default=None, help='branch to filter on')
 @click.option('--output-format', default='table',
-              type=click.Choice(['table', 'json']),
+              type=click.Choice(output_formats),
               help='Output format')
 @click.option('--columns', default=default_queued_build_list_columns,
               help='comma-separated list of columns to show in table')
-def build_queue_list(ctx, build_type_id, branch, output_format, columns):
+@click.option('--concurrency', default=default_concurrency,
+              type=click.IntRange(1, None),
+              help='Max number of queued build details to fetch in parallel')
+def build_queue_list(ctx, build_type_id, branch, output_format, columns,
+                     concurrency):
     """List queued build(s)"""
-    data = ctx.obj.get_queued_builds()
+    if output_format in ('table', 'stream-table'):
+        column_names = columns.split(',')
+        fields = queued_build_table.get_fields_expression(column_names)
+        data = get_with_fields(ctx.obj.get_queued_builds, fields)
+    else:
+        data = ctx.obj.get_queued_builds()
+    if output_format == 'ndjson':
+        output_ndjson(data.get('build', []))
+        return
     click.echo('count: %d' % data['count'])
     if data['count'] == 0:
         return
 
-    if output_format == 'table':
-        column_names = columns.split(',')
-        output_table(column_names, data['build'])
+    if output_format in ('table', 'stream-table'):
+        builds = queued_build_table.iter_fill(ctx.obj, data['build'],
+                                              column_names, concurrency)
+        output_table(column_names, builds,
+                     stream=output_format == 'stream-table')
     elif output_format == 'json':
         output_json_data(data)
 
@@ -359,11 +2511,19 @@ def build_queue_list(ctx, build_type_id, branch, output_format, columns):
 @click.option('--show-all/--no-show-all', default=False,
               help='Show all data for build (very verbose)')
 @click.argument('args', nargs=-1)
-def build_queue_show(ctx, show_all, args):
-    for build_id in args:
-        all_data = ctx.obj.get_queued_build_by_build_id(build_id)
+@click.option('--output-format', default='json',
+              type=click.Choice(json_output_formats),
+              help='Output format')
+@click.option('--concurrency', default=default_concurrency,
+              type=click.IntRange(1, None),
+              help='Max number of queued builds to fetch in parallel')
+@click.option('--ids-from', type=click.File('r'), default=None,
+              help='file ("-" for stdin) with more IDs, one per line')
+def build_queue_show(ctx, show_all, output_format, concurrency, ids_from,
+                     args):
+    def output(all_data):
         if show_all:
-            output_json_data(all_data)
+            output_json_data(all_data, output_format)
         else:
             data = {
                 'id': all_data['id'],
@@ -381,7 +2541,13 @@ def build_queue_show(ctx, show_all, args):
             }
             if all_data['triggered'].get('type') == 'user':
                 data['username'] = all_data['triggered']['user']['username']
-            output_json_data(data)
+            output_json_data(data, output_format)
+
+    show_each(ctx.obj.get_queued_build_by_build_id,
+              iter_ids(args, ids_from), output,
+              'queued build', concurrency,
+              get_many=functools.partial(get_items_by_ids, ctx.obj,
+                                         'buildQueue', 'build'))
 
 
 @build.group(name='show',
@@ -395,12 +2561,20 @@ def build_show():
               help='Show all data for build (very verbose)')
 @click.pass_context
 @click.argument('args', nargs=-1)
-def build_show_details(ctx, show_all, args):
+@click.option('--output-format', default='json',
+              type=click.Choice(json_output_formats),
+              help='Output format')
+@click.option('--concurrency', default=default_concurrency,
+              type=click.IntRange(1, None),
+              help='Max number of builds to fetch in parallel')
+@click.option('--ids-from', type=click.File('r'), default=None,
+              help='file ("-" for stdin) with more IDs, one per line')
+def build_show_details(ctx, show_all, output_format, concurrency, ids_from,
+                       args):
     """Display details for selected build(s)"""
-    for build_id in args:
-        all_data = ctx.obj.get_build_by_build_id(build_id)
+    def output(all_data):
         if show_all:
-            output_json_data(all_data)
+            output_json_data(all_data, output_format)
         else:
             data = {
                 'number': all_data['number'],
@@ -419,27 +2593,65 @@ def build_show_details(ctx, show_all, args):
             }
             if all_data['triggered'].get('type') == 'user':
                 data['username'] = all_data['triggered']['user']['username']
-            output_json_data(data)
+            output_json_data(data, output_format)
+
+    show_each(ctx.obj.get_build_by_build_id,
+              iter_ids(args, ids_from), output, 'build',
+              concurrency,
+              get_many=functools.partial(get_items_by_ids, ctx.obj,
+                                         'builds', 'build'))
 
 
 @build_show.command(name='statistics')
 @click.pass_context
 @click.argument('args', nargs=-1)
-def build_show_statistics(ctx, args):
+@click.option('--output-format', default='json',
+              type=click.Choice(json_output_formats),
+              help='Output format')
+@click.option('--concurrency', default=default_concurrency,
+              type=click.IntRange(1, None),
+              help='Max number of builds to fetch in parallel')
+@click.option('--ids-from', type=click.File('r'), default=None,
+              help='file ("-" for stdin) with more IDs, one per line')
+def build_show_statistics(ctx, output_format, concurrency, ids_from, args):
     """Display statistics for selected build(s)"""
-    for build_id in args:
-        data = ctx.obj.get_build_statistics_by_build_id(build_id)
-        output_json_data(data)
+    show_each(ctx.obj.get_build_statistics_by_build_id,
+              iter_ids(args, ids_from),
+              lambda data: output_json_data(data, output_format),
+              'build', concurrency)
 
 
 @build_show.command(name='log')
 @click.pass_context
+@click.option('--head', default=None, type=click.IntRange(0, None),
+              help='Only show the first N lines')
+@click.option('--tail', default=None, type=click.IntRange(0, None),
+              help='Only show the last N lines')
+@click.option('--grep', 'pattern', default=None,
+              help='Only show lines matching this regular expression')
+@click.option('--follow', is_flag=True, default=False,
+              help='Keep showing new lines until the build finishes')
+@click.option('--poll-interval', default=default_poll_interval, type=float,
+              help='Seconds between checks for new lines with --follow')
 @click.argument('args', nargs=-1)
-def build_show_log(ctx, args):
+@click.option('--ids-from', type=click.File('r'), default=None,
+              help='file ("-" for stdin) with more IDs, one per line')
+def build_show_log(ctx, head, tail, pattern, follow, poll_interval, ids_from,
+                   args):
     """Display log for selected build(s)"""
-    for build_id in args:
-        data = ctx.obj.get_build_log_by_build_id(build_id)
-        click.echo(data.text)
+    if follow and tail is not None:
+        raise click.UsageError('--tail cannot be used with --follow')
+    for build_id in iter_ids(args, ids_from):
+        if follow:
+            chunks = follow_build_log(ctx.obj, build_id, poll_interval)
+            output_bytes(filter_log(chunks, head, tail, pattern))
+            continue
+        response = get_build_log_response(ctx.obj, build_id)
+        try:
+            chunks = response.iter_content(chunk_size=64 * 1024)
+            output_bytes(filter_log(chunks, head, tail, pattern))
+        finally:
+            response.close()
 
 
 @build_show.command(name='artifacts')
@@ -447,7 +2659,11 @@ def build_show_log(ctx, args):
 @click.argument('build_id')
 @click.argument('data_type', default='')
 @click.argument('artifact_relative_name', default='')
-def build_show_artifacts(ctx, build_id, data_type, artifact_relative_name):
+@click.option('--output-format', default='json',
+              type=click.Choice(json_output_formats),
+              help='Output format')
+def build_show_artifacts(ctx, output_format, build_id, data_type,
+                         artifact_relative_name):
     """Display artifacts for selected build(s)"""
     data = ctx.obj.get_build_artifacts_by_build_id(
         build_id,
@@ -456,53 +2672,87 @@ def build_show_artifacts(ctx, build_id, data_type, artifact_relative_name):
     if hasattr(data, 'startswith'):
         click.echo(data)
     else:
-        output_json_data(data)
+        output_json_data(data, output_format)
 
 
 @build_show.command(name='parameters')
 @click.pass_context
 @click.option('--output-format', default='table',
-              type=click.Choice(['table', 'json']),
+              type=click.Choice(output_formats),
               help='Output format')
 @click.argument('args', nargs=-1)
-def build_show_parameters(ctx, output_format, args):
+@click.option('--concurrency', default=default_concurrency,
+              type=click.IntRange(1, None),
+              help='Max number of builds to fetch in parallel')
+@click.option('--ids-from', type=click.File('r'), default=None,
+              help='file ("-" for stdin) with more IDs, one per line')
+def build_show_parameters(ctx, output_format, concurrency, ids_from, args):
     """Display parameters for selected build(s)"""
     column_names = ['name', 'value']
-    for build_id in args:
-        response = ctx.obj.get_build_parameters_by_build_id(build_id)
+
+    def output(response):
         data = response['property']
-        if output_format == 'table':
-            output_table(column_names, data)
+        if output_format in ('table', 'stream-table'):
+            output_table(column_names, data,
+                         stream=output_format == 'stream-table')
         elif output_format == 'json':
             output_json_data(data)
+        elif output_format == 'ndjson':
+            output_ndjson(data)
+
+    show_each(ctx.obj.get_build_parameters_by_build_id,
+              iter_ids(args, ids_from), output,
+              'build', concurrency)
 
 
 @build_show.command(name='tags')
 @click.pass_context
 @click.argument('args', nargs=-1)
-def build_show_tags(ctx, args):
+@click.option('--output-format', default='json',
+              type=click.Choice(json_output_formats),
+              help='Output format')
+@click.option('--concurrency', default=default_concurrency,
+              type=click.IntRange(1, None),
+              help='Max number of builds to fetch in parallel')
+@click.option('--ids-from', type=click.File('r'), default=None,
+              help='file ("-" for stdin) with more IDs, one per line')
+def build_show_tags(ctx, output_format, concurrency, ids_from, args):
     """Display tags for selected build(s)"""
-    for build_id in args:
-        data = ctx.obj.get_build_tags_by_build_id(build_id)
-        output_json_data(data)
+    show_each(ctx.obj.get_build_tags_by_build_id, iter_ids(args, ids_from),
+              lambda data: output_json_data(data, output_format),
+              'build', concurrency)
 
 
 @user.command(name='list')
 @click.pass_context
-def user_list(ctx):
+@click.option('--output-format', default='json',
+              type=click.Choice(json_output_formats),
+              help='Output format')
+def user_list(ctx, output_format):
     """Display list of users"""
     data = ctx.obj.get_all_users()
-    output_json_data(data)
+    if output_format == 'ndjson':
+        output_ndjson(data['user'])
+    else:
+        output_json_data(data)
 
 
 @user.command(name='show')
 @click.pass_context
 @click.argument('args', nargs=-1)
-def user_show(ctx, args):
+@click.option('--output-format', default='json',
+              type=click.Choice(json_output_formats),
+              help='Output format')
+@click.option('--concurrency', default=default_concurrency,
+              type=click.IntRange(1, None),
+              help='Max number of users to fetch in parallel')
+@click.option('--ids-from', type=click.File('r'), default=None,
+              help='file ("-" for stdin) with more IDs, one per line')
+def user_show(ctx, output_format, concurrency, ids_from, args):
     """Display info for selected users"""
-    for user_id in args:
-        data = ctx.obj.get_user_by_username(user_id)
-        output_json_data(data)
+    show_each(ctx.obj.get_user_by_username, iter_ids(args, ids_from),
+              lambda data: output_json_data(data, output_format),
+              'user', concurrency)
 
 
 @server.group(name='plugin')
@@ -512,10 +2762,16 @@ def server_plugin():
 
 @server_plugin.command(name='list')
 @click.pass_context
-def server_plugin_list(ctx):
+@click.option('--output-format', default='json',
+              type=click.Choice(json_output_formats),
+              help='Output format')
+def server_plugin_list(ctx, output_format):
     """Display list of plugins"""
     data = ctx.obj.get_all_plugins()
-    output_json_data(data)
+    if output_format == 'ndjson':
+        output_ndjson(data['plugin'])
+    else:
+        output_json_data(data)
 
 
 @server.group(name='agent')
@@ -525,65 +2781,120 @@ def server_agent():
 
 @server_agent.command(name='statistics')
 @click.pass_context
-def server_agent_statistics(ctx):
+@click.option('--output-format', default='json',
+              type=click.Choice(json_output_formats),
+              help='Output format')
+def server_agent_statistics(ctx, output_format):
     """Display statistics for agents - num_idle, etc."""
     data = ctx.obj.get_agent_statistics()
-    output_json_data(data)
+    output_json_data(data, output_format)
 
 
 @server_agent.command(name='list')
 @click.option('--output-format', default='table',
-              type=click.Choice(['table', 'json']),
+              type=click.Choice(output_formats),
               help='Output format')
 @click.option('--columns', default=default_agent_list_columns,
               help='comma-separated list of columns to show in table')
+@click.option('--concurrency', default=default_concurrency,
+              type=click.IntRange(1, None),
+              help='Max number of agents to fetch details for in parallel')
 @click.pass_context
-def server_agent_list(ctx, output_format, columns):
+def server_agent_list(ctx, output_format, columns, concurrency):
     """Display list of agents"""
-    data = ctx.obj.get_agents()
+    if output_format in ('table', 'stream-table'):
+        column_names = columns.split(',')
+    else:
+        column_names = ['typeId', 'href', 'webUrl'] + \
+            default_agent_list_columns.split(',')
 
-    for agent in data['agent']:
-        agent_info = ctx.obj.get_agent_by_agent_id(agent['id'])
-        agent['ip'] = agent_info['ip']
-        agent['pool'] = agent_info['pool']['name']
-        agent['build_type'] = ctx.obj.get_agent_build_type(agent['id'])
-        agent['build_text'] = ctx.obj.get_agent_build_text(agent['id'])
+    fields = agent_table.get_fields_expression(column_names)
+    data = get_with_fields(ctx.obj.get_agents, fields)
+    agents = agent_table.iter_fill(ctx.obj, data['agent'], column_names,
+                                   concurrency)
 
-    if output_format == 'table':
-        column_names = columns.split(',')
-        output_table(column_names, data['agent'])
+    if output_format in ('table', 'stream-table'):
+        output_table(column_names, agents,
+                     stream=output_format == 'stream-table')
     elif output_format == 'json':
+        agent_table.fill(ctx.obj, data['agent'], column_names, concurrency)
         output_json_data(data)
+    elif output_format == 'ndjson':
+        output_ndjson(agents)
 
 
 @server_agent.command(name='show')
 @click.pass_context
 @click.argument('args', nargs=-1)
-def server_agent_show(ctx, args):
+@click.option('--output-format', default='json',
+              type=click.Choice(json_output_formats),
+              help='Output format')
+@click.option('--concurrency', default=default_concurrency,
+              type=click.IntRange(1, None),
+              help='Max number of agents to fetch in parallel')
+@click.option('--ids-from', type=click.File('r'), default=None,
+              help='file ("-" for stdin) with more IDs, one per line')
+def server_agent_show(ctx, output_format, concurrency, ids_from, args):
     """Display info for selected agent(s)"""
-    for agent_id in args:
-        data = ctx.obj.get_agent_by_agent_id(agent_id)
-        output_json_data(data)
+    show_each(ctx.obj.get_agent_by_agent_id, iter_ids(args, ids_from),
+              lambda data: output_json_data(data, output_format),
+              'agent', concurrency)
 
 
 @change.command(name='list')
 @click.pass_context
 @click.option('--start', default=0, help='Start index')
-@click.option('--count', default=10, help='Max number of items to show')
-def change_list(ctx, start, count):
+@click.option('--count', default=10,
+              help='Max number of items to show, or per page with '
+                   '--all/--limit')
+@click.option('--all', 'fetch_all', is_flag=True, default=False,
+              help='Show all changes, following pages to the last one')
+@click.option('--limit', default=None, type=click.IntRange(1, None),
+              help='Show up to this many changes, fetching pages in parallel')
+@click.option('--concurrency', default=default_concurrency,
+              type=click.IntRange(1, None),
+              help='Max number of pages to fetch in parallel')
+@click.option('--output-format', default='json',
+              type=click.Choice(json_output_formats),
+              help='Output format')
+def change_list(ctx, start, count, fetch_all, limit, concurrency,
+                output_format):
     """Display list of changes"""
-    data = ctx.obj.get_all_changes(start=start, count=count)
-    output_json_data(data)
+    if fetch_all or limit is not None:
+        changes = iter_pages(ctx.obj, ctx.obj.get_all_changes, 'change',
+                             limit=limit, concurrency=concurrency,
+                             start=start, count=count)
+        if output_format == 'ndjson':
+            output_ndjson(changes)
+            return
+        changes = list(changes)
+        data = {'count': len(changes), 'change': changes}
+    else:
+        data = ctx.obj.get_all_changes(start=start, count=count)
+    if output_format == 'ndjson':
+        output_ndjson(data.get('change', []))
+    else:
+        output_json_data(data)
 
 
 @change.command(name='show')
 @click.pass_context
 @click.argument('args', nargs=-1)
-def change_show(ctx, args):
+@click.option('--output-format', default='json',
+              type=click.Choice(json_output_formats),
+              help='Output format')
+@click.option('--concurrency', default=default_concurrency,
+              type=click.IntRange(1, None),
+              help='Max number of changes to fetch in parallel')
+@click.option('--ids-from', type=click.File('r'), default=None,
+              help='file ("-" for stdin) with more IDs, one per line')
+def change_show(ctx, output_format, concurrency, ids_from, args):
     """Display info for selected changes"""
-    for change_id in args:
-        data = ctx.obj.get_change_by_change_id(change_id)
-        output_json_data(data)
+    show_each(ctx.obj.get_change_by_change_id, iter_ids(args, ids_from),
+              lambda data: output_json_data(data, output_format),
+              'change', concurrency,
+              get_many=functools.partial(get_items_by_ids, ctx.obj,
+                                         'changes', 'change'))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,269 @@
+"""asyncio backend for the teamcity CLI, selected with `--backend async`
+
+Requests that commands fan out over many items (the build details of
+`build list`, the agents of `server agent list`) run as coroutines on an
+event loop, sending their requests with httpx, instead of each taking a
+thread from a pool. Everything else still goes through pyteamcity.
+
+Needs httpx (`pip install teamcity_cli[async]`), and Python 3.
+"""
+
+import asyncio
+import functools
+import itertools
+import threading
+import time
+
+import httpx
+from pyteamcity import ConnectionError, HTTPError
+
+import teamcitycli
+
+
+# GET methods of pyteamcity's TeamCity that can give the URL they would
+# get, with return_type='url', and so can be sent with httpx instead.
+# The others run in a thread of the event loop's executor.
+endpoint_methods = frozenset([
+    'get_agent_by_agent_id',
+    'get_agents',
+    'get_all_changes',
+    'get_build_by_build_id',
+    'get_build_parameters_by_build_id',
+    'get_build_statistics_by_build_id',
+    'get_build_tags_by_build_id',
+    'get_build_type',
+    'get_builds',
+    'get_change_by_change_id',
+    'get_project_by_project_id',
+    'get_queued_build_by_build_id',
+    'get_queued_builds',
+])
+
+
+class AsyncTeamCity(object):
+    """Wraps a pyteamcity TeamCity, adding an event loop to fan out on
+
+    Its attributes are the TeamCity's, except for gather_map. The event
+    loop runs in a thread of its own, so that the CLI's commands can stay
+    synchronous. Responses are cached in, and served from, the same cache
+    as the TeamCity session's.
+    """
+
+    def __init__(self, teamcity, pool_size=teamcitycli.default_pool_size,
+                 timeout=teamcitycli.default_timeout):
+        self.teamcity = teamcity
+        self.aio = AsyncMethods(self)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        limits = httpx.Limits(max_connections=pool_size,
+                              max_keepalive_connections=pool_size)
+        self.client = self.run(self.make_client(limits, timeout))
+        # Only changed on the event loop, see get_connection_stats
+        self.connections = 0
+        self.requests = 0
+
+    def __getattr__(self, name):
+        return getattr(self.teamcity, name)
+
+    async def make_client(self, limits, timeout):
+        return httpx.AsyncClient(limits=limits, timeout=timeout)
+
+    def run(self, coroutine):
+        """Run coroutine on the event loop and return its result"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def gather_map(self, func, items, concurrency):
+        """Like teamcitycli.concurrent_map, but with coroutines
+
+        func(client, item) is given the coroutine methods of this client
+        and must return a dict of awaitables; the result for item is the
+        dict of what they return. At most concurrency items are worked on
+        at once, under a semaphore.
+        """
+        semaphore = self.run(self.make_semaphore(concurrency))
+
+        async def call(item):
+            async with semaphore:
+                try:
+                    calls = func(self.aio, item)
+                    results = await asyncio.gather(*calls.values())
+                    return item, dict(zip(calls.keys(), results)), None
+                except Exception as e:
+                    return item, None, e
+
+        pending = []
+        try:
+            for item in items:
+                pending.append(asyncio.run_coroutine_threadsafe(
+                    call(item), self.loop))
+                # Like concurrent_map, don't read all of items upfront
+                if len(pending) >= 2 * concurrency:
+                    yield pending.pop(0).result()
+            while pending:
+                yield pending.pop(0).result()
+        finally:
+            # The loop is already closed if the client was closed first,
+            # e.g. when stdout went away while the items were still coming
+            if not self.loop.is_closed():
+                for future in pending:
+                    future.cancel()
+
+    def get_connection_stats(self):
+        """Like TeamCitySession.get_connection_stats, for httpx's pool"""
+        return {'connections': self.connections, 'requests': self.requests}
+
+    async def make_semaphore(self, concurrency):
+        return asyncio.Semaphore(concurrency)
+
+    async def acquire(self, limiter):
+        """Like RateLimiter.acquire, without blocking the event loop"""
+        if limiter is None:
+            return None
+        started = None
+        while True:
+            slot, delay = limiter.try_acquire()
+            if not delay:
+                if started is not None:
+                    limiter.add_wait(self.loop.time() - started)
+                return slot
+            if started is None:
+                started = self.loop.time()
+            await asyncio.sleep(delay)
+
+    async def get(self, url):
+        """GET url, like pyteamcity's GET methods do"""
+        session = self.teamcity.session
+        request = self.teamcity._get_request('GET', url)
+        trace = teamcitycli.RequestTrace(
+            'GET', request.url,
+            cache=None if session.cache is None else 'refresh')
+        response = None
+        if session.cache is not None and not session.is_refreshing():
+            trace.cache = 'miss'
+            response = session.get_cached_response(request.url,
+                                                   request.headers, request)
+            if response is not None:
+                trace.cache = 'hit'
+                trace.finish(response.status_code, response)
+                session.traces.append(trace)
+        if response is None:
+            response = await self.send_retrying(request, trace)
+            if session.cache is not None:
+                session.cache_response(request, response)
+        if response.status_code >= 400:
+            raise HTTPError(response.text, url=url,
+                            status_code=response.status_code)
+        if response.headers.get('Content-Type') == 'application/json':
+            return teamcitycli.loads_json(response.content)
+        return response.content
+
+    async def send_retrying(self, request, trace):
+        """Like TeamCitySession.send_retrying, for GETs"""
+        session = self.teamcity.session
+        for attempt in itertools.count():
+            trace.attempts = attempt + 1
+            response = None
+            try:
+                if session.hedge_after is not None:
+                    response, hedged = await self.send_hedged(request, trace)
+                    trace.hedged = trace.hedged or hedged
+                else:
+                    response = await self.send(request, trace)
+            except ConnectionError as e:
+                if attempt >= session.retries:
+                    trace.finish(e.__class__.__name__)
+                    session.traces.append(trace)
+                    raise
+            else:
+                if attempt >= session.retries or \
+                        response.status_code not in teamcitycli.retry_statuses:
+                    trace.finish(response.status_code)
+                    trace.bytes = len(response.content)
+                    session.traces.append(trace)
+                    return response
+            await asyncio.sleep(teamcitycli.get_retry_delay(attempt,
+                                                            response))
+
+    async def send_hedged(self, request, trace):
+        """Like TeamCitySession.send_hedged"""
+        tasks = [asyncio.ensure_future(self.send(request, trace))]
+        done, _ = await asyncio.wait(
+            tasks, timeout=self.teamcity.session.hedge_after)
+        hedged = not done
+        if hedged:
+            tasks.append(asyncio.ensure_future(self.send(request, trace)))
+        error = None
+        for task in asyncio.as_completed(tasks):
+            try:
+                response = await task
+            except ConnectionError as e:
+                error = e
+                continue
+            for other in tasks:
+                other.cancel()
+            return response, hedged
+        raise error
+
+    async def send(self, request, trace):
+        limiter = self.teamcity.session.limiter
+        slot = await self.acquire(limiter)
+        self.requests += 1
+        try:
+            return await self.client.get(
+                request.url, headers=dict(request.headers),
+                extensions={'trace': functools.partial(
+                    self.trace_event, trace, {})})
+        except httpx.TransportError as e:
+            raise ConnectionError(self.teamcity.host, self.teamcity.port, e)
+        finally:
+            if limiter is not None:
+                limiter.release(slot)
+
+    async def trace_event(self, trace, started, name, info):
+        """Callback of httpx's trace extension, timing connecting and the
+        first byte of the response into trace
+
+        Unlike with requests, the DNS lookup is part of connecting.
+        """
+        now = time.time()
+        step, _, event = name.rpartition('.')
+        if event == 'started':
+            started[step] = now
+        elif event != 'complete':
+            return
+        elif step in ('connection.connect_tcp', 'connection.start_tls'):
+            trace.connect = (trace.connect or 0) + now - started[step]
+            if step == 'connection.connect_tcp':
+                self.connections += 1
+        elif step.endswith('.receive_response_headers'):
+            trace.ttfb = now - trace.start
+
+    def close(self):
+        try:
+            self.run(self.client.aclose())
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop.close()
+            self.teamcity.session.close()
+
+
+class AsyncMethods(object):
+    """The methods of an AsyncTeamCity's TeamCity, as coroutines"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def __getattr__(self, name):
+        method = getattr(self.client.teamcity, name)
+        if name in endpoint_methods:
+            async def call(*args, **kwargs):
+                url = method(*args, return_type='url', **kwargs)
+                return await self.client.get(url)
+        else:
+            async def call(*args, **kwargs):
+                return await self.client.loop.run_in_executor(
+                    None, functools.partial(method, *args, **kwargs))
+        return call
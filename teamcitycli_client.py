@@ -0,0 +1,175 @@
+"""Thin client for `teamcity daemon`
+
+Sends its command line to a running daemon and writes the output that
+the daemon streams back, so that scripts running many teamcity commands
+don't pay for loading the CLI and connecting to the server each time.
+Runs the command itself when there is no daemon, when the command
+reads stdin, or when it waits for a build. Only uses the standard
+library, so that it starts quickly.
+
+    $ teamcity daemon --idle-timeout 3600 &
+    $ teamcity-client build list
+"""
+
+import errno
+import json
+import os
+import socket
+import stat
+import struct
+import sys
+
+
+# Frames from the daemon are a channel byte, a 4-byte length and data.
+# The EXIT frame holds the exit status and is the last one.
+EXIT, STDOUT, STDERR = 0, 1, 2
+frame_header = struct.Struct('>BI')
+# Options that make a command wait for as long as a build runs. The daemon
+# runs one command at a time, so these run locally instead, not to hold
+# up other clients.
+waiting_options = frozenset(['--follow', '--wait-for-run',
+                             '--wait-for-finish'])
+
+
+def get_socket_path():
+    """Where the daemon listens, unless overridden with --socket"""
+    path = os.environ.get('TEAMCITY_CLI_SOCKET')
+    if path:
+        return path
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return os.path.join(runtime_dir, 'teamcity_cli.sock')
+    # In a directory of its own, which check_socket_dir makes sure of,
+    # since anyone can create files in /tmp
+    return '/tmp/teamcity_cli-%d/daemon.sock' % os.getuid()
+
+
+def check_socket_dir(directory):
+    """Return why the daemon's socket must not be in directory, or None
+
+    Clients send the daemon their TEAMCITY_* environment, which can include
+    TEAMCITY_PASSWORD, so no one else may be able to put a socket of their
+    own in its place.
+    """
+    st = os.lstat(directory)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid not in (os.getuid(), 0):
+        return '%s is not a directory of yours' % directory
+    # Like /tmp, a sticky directory only lets owners replace their files
+    if st.st_mode & 0o022 and not st.st_mode & stat.S_ISVTX:
+        return '%s can be written to by other users' % directory
+    return None
+
+
+def check_socket(path):
+    """Return why the socket at path may not be the user's own daemon's, or
+    None. Raises OSError if there is no socket at path."""
+    problem = check_socket_dir(os.path.dirname(os.path.abspath(path)))
+    if problem is not None:
+        return problem
+    st = os.lstat(path)
+    if st.st_uid != os.getuid() or st.st_mode & 0o022:
+        return '%s is not a socket of yours' % path
+    return None
+
+
+def get_teamcity_env():
+    """The environment variables that configure the TeamCity client"""
+    return dict((name, value) for name, value in os.environ.items()
+                if name.startswith('TEAMCITY_'))
+
+
+def write_frame(sock, channel, data):
+    sock.sendall(frame_header.pack(channel, len(data)) + data)
+
+
+def read_exactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def read_frame(sock):
+    """Returns (channel, data), or (None, None) if the daemon went away"""
+    header = read_exactly(sock, frame_header.size)
+    if header is None:
+        return None, None
+    channel, size = frame_header.unpack(header)
+    data = read_exactly(sock, size)
+    if data is None:
+        return None, None
+    return channel, data
+
+
+def get_binary_stream(stream):
+    return getattr(stream, 'buffer', stream)
+
+
+def run_locally():
+    from teamcitycli import cli
+    cli(prog_name='teamcity')
+
+
+def main():
+    argv = sys.argv[1:]
+    # The daemon has no access to our stdin, and shouldn't start itself
+    if 'daemon' in argv or [arg for arg in argv
+                            if arg == '-' or arg.endswith('=-')]:
+        return run_locally()
+    if waiting_options.intersection(argv):
+        return run_locally()
+    socket_path = get_socket_path()
+    try:
+        problem = check_socket(socket_path)
+    except OSError:
+        return run_locally()
+    if problem is not None:
+        sys.stderr.write('WARNING: not using teamcity daemon: %s\n' % problem)
+        return run_locally()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except socket.error:
+        sock.close()
+        return run_locally()
+
+    request = {
+        'argv': argv,
+        'cwd': os.getcwd(),
+        'env': get_teamcity_env(),
+        'tty': {'stdout': sys.stdout.isatty(),
+                'stderr': sys.stderr.isatty()},
+    }
+    sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+
+    streams = {STDOUT: get_binary_stream(sys.stdout),
+               STDERR: get_binary_stream(sys.stderr)}
+    try:
+        while True:
+            channel, data = read_frame(sock)
+            if channel is None:
+                sys.stderr.write('ERROR: teamcity daemon went away\n')
+                sys.exit(1)
+            if channel == EXIT:
+                sys.exit(int(data))
+            streams[channel].write(data)
+            streams[channel].flush()
+    except IOError as e:
+        if e.errno != errno.EPIPE:
+            raise
+        # Stdout was closed early, e.g. by `| head`; Python would complain
+        # again when flushing it on exit
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        sys.exit(1)
+    except KeyboardInterrupt:
+        sys.exit(130)
+    finally:
+        sock.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+import json
+import re
+import time
+
+import pytest
+import requests
+
+import teamcitycli
+
+base_url = 'http://teamcity.example.com/httpAuth/app/rest'
+
+
+@pytest.fixture
+def session(tmp_path):
+    cache = teamcitycli.ResponseCache(str(tmp_path / 'responses.sqlite'))
+    session = teamcitycli.TeamCitySession(cache=cache)
+    yield session
+    session.close()
+
+
+def make_request(path):
+    return requests.Request('GET', base_url + path).prepare()
+
+
+def make_response(data, status_code=200):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers['Content-Type'] = 'application/json'
+    response._content = json.dumps(data).encode('utf-8')
+    return teamcitycli.use_json_backend(response)
+
+
+def cache_build(session, state):
+    request = make_request('/builds/id:5')
+    response = make_response({'id': 5, 'state': state})
+    session.cache.set(
+        session.get_cache_key('GET', request.url, request.headers),
+        None, 200, response.headers, response.content)
+
+
+@pytest.mark.parametrize('state, ttl', [('finished', None), ('running', 5)])
+def test_build_ttl_depends_on_state(session, state, ttl):
+    response = make_response({'id': 5, 'state': state})
+    assert session.get_cache_ttl(make_request('/builds/id:5'),
+                                 response) == ttl
+
+
+@pytest.mark.parametrize('subpath', ['statistics', 'resulting-properties'])
+def test_finished_build_data_cached_forever(session, subpath):
+    cache_build(session, 'finished')
+    request = make_request('/builds/id:5/%s' % subpath)
+    assert session.get_cache_ttl(request, make_response({})) is None
+
+
+def test_running_build_data_expires(session):
+    cache_build(session, 'running')
+    request = make_request('/builds/id:5/statistics')
+    assert session.get_cache_ttl(request, make_response({})) == 5
+
+
+@pytest.mark.parametrize('subpath', ['tags', 'pin', 'comment'])
+def test_editable_build_data_expires(session, subpath):
+    cache_build(session, 'finished')
+    request = make_request('/builds/id:5/%s' % subpath)
+    assert session.get_cache_ttl(request, make_response({})) == 5
+
+
+@pytest.mark.parametrize('path, ttl', [
+    ('/changes/id:12', None),
+    ('/changes?locator=build:(id:5)', 30),
+    ('/buildQueue', 5),
+    ('/agents', 5),
+    ('/projects/id:Project', 300),
+    ('/server', 3600),
+    ('/vcs-root-instances', 0),
+])
+def test_ttl_by_path(session, path, ttl):
+    response = make_response({})
+    assert session.get_cache_ttl(make_request(path), response) == ttl
+
+
+def test_artifacts_not_cached(session):
+    request = make_request('/builds/id:5/artifacts/files/build.zip')
+    assert session.get_cache_ttl(request, make_response({})) == 0
+
+
+def test_cache_is_private(tmp_path):
+    path = tmp_path / 'teamcity_cli' / 'responses.sqlite'
+    teamcitycli.ResponseCache(str(path)).close()
+    assert path.parent.stat().st_mode & 0o777 == 0o700
+    assert path.stat().st_mode & 0o777 == 0o600
+
+
+def test_expired_responses_deleted_on_close(tmp_path):
+    path = str(tmp_path / 'responses.sqlite')
+    cache = teamcitycli.ResponseCache(path)
+    cache.set('expired', -1, 200, {}, b'old')
+    cache.set('fresh', 60, 200, {}, b'new')
+    cache.close()
+    cache = teamcitycli.ResponseCache(path)
+    assert cache.stats()['entries'] == 1
+    assert cache.get('fresh') == (200, {}, b'new')
+    cache.close()
+
+
+def test_unchanging_responses_expire_eventually(tmp_path, monkeypatch):
+    monkeypatch.setattr(teamcitycli, 'max_cache_age', -1)
+    cache = teamcitycli.ResponseCache(str(tmp_path / 'responses.sqlite'))
+    cache.set('finished', None, 200, {}, b'old')
+    assert cache.get('finished') is None
+    assert cache.clear(expired_only=True) == 1
+    cache.close()
+
+
+def test_responses_stored_forever_get_max_age(tmp_path):
+    path = str(tmp_path / 'responses.sqlite')
+    cache = teamcitycli.ResponseCache(path)
+    with cache.db:
+        cache.db.execute("INSERT INTO responses VALUES "
+                         "('finished', NULL, 200, '{}', x'')")
+    cache.close()
+    cache = teamcitycli.ResponseCache(path)
+    expires, = cache.db.execute('SELECT expires FROM responses').fetchone()
+    assert expires > time.time() + teamcitycli.max_cache_age - 60
+    cache.close()
+
+
+def test_large_responses_not_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr(teamcitycli, 'max_cached_response_bytes', 10)
+    cache = teamcitycli.ResponseCache(str(tmp_path / 'responses.sqlite'))
+    cache.set('large', 60, 200, {}, b'x' * 11)
+    cache.set('small', 60, 200, {}, b'x' * 10)
+    assert cache.get('large') is None
+    assert cache.get('small') is not None
+    cache.close()
+
+
+class FakeClient(object):
+    """Answers listings of builds with the builds in their item: locator"""
+
+    base_url = base_url
+
+    def __init__(self, session):
+        self.session = session
+        self.urls = []
+
+    def _get_request(self, verb, url):
+        return requests.Request(
+            verb, url, headers={'Accept': 'application/json'}).prepare()
+
+    def _get(self, url):
+        self.urls.append(url)
+        builds = [{'id': int(build_id), 'state': 'finished'}
+                  for build_id in re.findall(r'item:\(id:(\d+)\)', url)]
+        return make_response({'count': len(builds), 'build': builds})
+
+
+def test_items_by_ids_stored_per_id(session):
+    client = FakeClient(session)
+    builds = teamcitycli.get_items_by_ids(client, 'builds', 'build', [5, 6])
+    assert sorted(builds) == [5, 6]
+    assert len(client.urls) == 1
+    request = make_request('/builds/id:6')
+    response = session.get_cached_response(request.url, client._get_request(
+        'GET', request.url).headers)
+    assert response.json() == {'id': 6, 'state': 'finished'}
+
+    assert teamcitycli.get_items_by_ids(client, 'builds', 'build',
+                                        [5, 6]) == builds
+    assert len(client.urls) == 1
+
+
+def test_items_by_ids_only_gets_uncached(session):
+    client = FakeClient(session)
+    request = client._get_request('GET', base_url + '/builds/id:5')
+    session.cache_response(request, make_response({'id': 5,
+                                                   'state': 'finished'}))
+    builds = teamcitycli.get_items_by_ids(client, 'builds', 'build', [5, 6])
+    assert sorted(builds) == [5, 6]
+    assert 'id:5' not in client.urls[0]
+    assert 'item:(id:6)' in client.urls[0]
+
+
+def test_cache_that_cant_be_opened_skipped(tmp_path, monkeypatch, capsys):
+    # e.g. a read-only or missing HOME
+    (tmp_path / 'cache').write_text(u'not a directory')
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    assert teamcitycli.open_response_cache() is None
+    assert capsys.readouterr().err.startswith(
+        'WARNING: not caching responses: ')
@@ -0,0 +1,75 @@
+import os
+import socket
+
+import pytest
+
+import teamcitycli_client
+
+
+@pytest.fixture
+def socket_path(tmp_path):
+    directory = tmp_path / 'daemon'
+    directory.mkdir(0o700)
+    path = str(directory / 'daemon.sock')
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o077)
+    try:
+        sock.bind(path)
+    finally:
+        os.umask(umask)
+    yield path
+    sock.close()
+
+
+def test_own_socket_accepted(socket_path):
+    assert teamcitycli_client.check_socket(socket_path) is None
+
+
+def test_missing_socket_raises(tmp_path):
+    with pytest.raises(OSError):
+        teamcitycli_client.check_socket(str(tmp_path / 'daemon.sock'))
+
+
+def test_socket_in_shared_directory_refused(socket_path):
+    os.chmod(os.path.dirname(socket_path), 0o777)
+    assert 'other users' in teamcitycli_client.check_socket(socket_path)
+
+
+def test_socket_in_sticky_directory_accepted(socket_path):
+    os.chmod(os.path.dirname(socket_path), 0o1777)
+    assert teamcitycli_client.check_socket(socket_path) is None
+
+
+def test_writable_socket_refused(socket_path):
+    os.chmod(socket_path, 0o777)
+    assert teamcitycli_client.check_socket(socket_path) is not None
+
+
+def test_symlinked_directory_refused(socket_path, tmp_path):
+    link = tmp_path / 'link'
+    link.symlink_to(os.path.dirname(socket_path))
+    path = str(link / 'daemon.sock')
+    assert teamcitycli_client.check_socket(path) is not None
+
+
+def test_default_socket_in_directory_of_its_own(monkeypatch):
+    monkeypatch.delenv('TEAMCITY_CLI_SOCKET', raising=False)
+    monkeypatch.delenv('XDG_RUNTIME_DIR', raising=False)
+    path = teamcitycli_client.get_socket_path()
+    assert os.path.dirname(path) == '/tmp/teamcity_cli-%d' % os.getuid()
+
+
+@pytest.mark.parametrize('argv', [
+    ['build', 'show', 'log', '--follow', '1'],
+    ['build', 'trigger', '--wait-for-finish', 'Project_Build'],
+    ['build', 'list', '--build-type-id', '-'],
+])
+def test_some_commands_run_locally(argv, monkeypatch):
+    ran = []
+    monkeypatch.setattr(teamcitycli_client, 'run_locally',
+                        lambda: ran.append(True))
+    monkeypatch.setattr(teamcitycli_client.sys, 'argv', ['teamcity'] + argv)
+    monkeypatch.setattr(teamcitycli_client, 'check_socket',
+                        lambda path: pytest.fail('used the daemon'))
+    teamcitycli_client.main()
+    assert ran == [True]
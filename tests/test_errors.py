@@ -0,0 +1,24 @@
+import click
+import pytest
+
+import teamcitycli
+
+
+def fail(item):
+    teamcitycli.error_handler(ValueError('Read timed out'))
+
+
+def test_request_errors_carry_their_message():
+    results = list(teamcitycli.concurrent_map(fail, [1, 2], concurrency=2))
+    assert [str(error) for _, _, error in results] == ['Read timed out'] * 2
+
+
+def test_request_errors_reported_once(capsys):
+    @click.command()
+    def command():
+        fail(1)
+
+    with pytest.raises(SystemExit) as exc_info:
+        command.main([])
+    assert exc_info.value.code == 1
+    assert capsys.readouterr().err == 'ERROR: Read timed out\n'
@@ -0,0 +1,38 @@
+import pytest
+
+import teamcitycli
+
+
+def test_stream_table_widths_from_window(capsys, monkeypatch):
+    monkeypatch.setattr(teamcitycli, 'stream_table_window', 2)
+    teamcitycli.output_stream_table(
+        ['id', 'name'], [['1', 'agent1'], ['2', 'agent2']])
+    assert capsys.readouterr().out.splitlines() == [
+        'id  name',
+        '--  ------',
+        '1   agent1',
+        '2   agent2',
+    ]
+
+
+def test_stream_table_widens_for_longer_values(capsys, monkeypatch):
+    monkeypatch.setattr(teamcitycli, 'stream_table_window', 2)
+    rows = [[str(agent_id), 'agent%d' % agent_id]
+            for agent_id in (8, 9, 100, 101)]
+    teamcitycli.output_stream_table(['id', 'name'], rows)
+    assert capsys.readouterr().out.splitlines() == [
+        'id  name',
+        '--  ------',
+        '8   agent8',
+        '9   agent9',
+        '100  agent100',
+        '101  agent101',
+    ]
+
+
+def test_indented_json_same_with_any_backend(monkeypatch):
+    expected = '{\n    "id": 1\n}'
+    for backend in [teamcitycli.json, pytest.importorskip('orjson')]:
+        monkeypatch.setattr(teamcitycli, 'json_backend', backend)
+        assert teamcitycli.dumps_json({'id': 1}) == expected
+        assert teamcitycli.dumps_json({'id': 1}, compact=True) == '{"id":1}'
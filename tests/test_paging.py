@@ -0,0 +1,94 @@
+import functools
+import json
+import re
+
+import requests
+
+import teamcitycli
+
+
+class FakeClient(object):
+    """Lists builds total down to 1, as TeamCity does, with nextHrefs that
+    leave out fields= like TeamCity's sometimes do"""
+
+    base_base_url = 'http://teamcity.example.com'
+    base_url = base_base_url + '/httpAuth/app/rest'
+
+    def __init__(self, total):
+        self.total = total
+        self.urls = []
+
+    def get_builds(self, start=0, count=100, return_type='data'):
+        return '%s/builds/?start=%d&count=%d' % (self.base_url, start, count)
+
+    def _get(self, url):
+        self.urls.append(url)
+        query = dict(re.findall(r'([^?&=]+)=([^&]*)', url))
+        start, count = int(query['start']), int(query['count'])
+        ids = range(self.total - start, max(self.total - start - count, 0), -1)
+        data = {'count': len(ids), 'build': [{'id': i} for i in ids]}
+        if start + count < self.total:
+            data['nextHref'] = '/httpAuth/app/rest/builds/?start=%d&count=%d' \
+                % (start + count, count)
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps(data).encode('utf-8')
+        return response
+
+
+def get_ids(items):
+    return [item['id'] for item in items]
+
+
+def test_limit_stops_at_short_page():
+    client = FakeClient(150)
+    items = teamcitycli.iter_pages(client, client.get_builds, 'build',
+                                   limit=1000)
+    assert get_ids(items) == list(range(150, 0, -1))
+
+
+def test_limit_asks_for_the_rest_on_last_page():
+    client = FakeClient(1000)
+    items = teamcitycli.iter_pages(client, client.get_builds, 'build',
+                                   limit=250, concurrency=1)
+    assert get_ids(items) == list(range(1000, 750, -1))
+    assert client.urls[-1].endswith('start=200&count=50')
+
+
+def test_next_href_followed_with_fields():
+    client = FakeClient(250)
+    func = functools.partial(teamcitycli.get_with_fields, client.get_builds,
+                             'count,nextHref,build(id)')
+    items = teamcitycli.iter_pages(client, func, 'build')
+    assert get_ids(items) == list(range(250, 0, -1))
+    assert len(client.urls) == 3
+    assert all(url.endswith('&fields=count,nextHref,build(id)')
+               for url in client.urls)
+
+
+def get_one(item):
+    if item == 'broken':
+        raise ValueError('not found')
+    return 'one %s' % item
+
+
+def get_many(items):
+    if 'fail' in items:
+        raise ValueError('bulk failed')
+    return dict((item, 'many %s' % item) for item in items
+                if item not in ('missing', 'broken'))
+
+
+def test_bulk_map_falls_back_to_single_items():
+    items = ['a', 'missing', 'b', 'fail', 'c', 'broken']
+    results = list(teamcitycli.bulk_map(get_one, get_many, items,
+                                        concurrency=2, chunk_size=2))
+    assert [(item, result) for item, result, _ in results] == [
+        ('a', 'many a'),
+        ('missing', 'one missing'),
+        ('b', 'one b'),
+        ('fail', 'one fail'),
+        ('c', 'many c'),
+        ('broken', None),
+    ]
+    assert str(results[-1][2]) == 'not found'
@@ -0,0 +1,104 @@
+import pytest
+
+import teamcitycli
+
+
+class FakeTime(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeTime()
+    monkeypatch.setattr(teamcitycli, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def shared_path(tmp_path):
+    return str(tmp_path / 'limits')
+
+
+def test_burst_then_wait_for_refill(clock):
+    limiter = teamcitycli.RateLimiter(rate=2)
+    assert limiter.try_acquire() == (None, 0)
+    assert limiter.try_acquire() == (None, 0)
+    assert limiter.try_acquire() == (None, 0.5)
+    clock.now += 0.25
+    assert limiter.try_acquire() == (None, 0.25)
+    clock.now += 0.25
+    assert limiter.try_acquire() == (None, 0)
+
+
+def test_burst_of_at_least_one(clock):
+    limiter = teamcitycli.RateLimiter(rate=0.5)
+    assert limiter.try_acquire() == (None, 0)
+    assert limiter.try_acquire() == (None, 2)
+
+
+def test_refill_capped_at_burst(clock):
+    limiter = teamcitycli.RateLimiter(rate=2)
+    clock.now += 60
+    delays = [limiter.try_acquire()[1] for _ in range(3)]
+    assert delays == [0, 0, 0.5]
+
+
+def test_acquire_counts_waits(clock):
+    limiter = teamcitycli.RateLimiter(rate=1)
+    limiter.acquire()
+    limiter.acquire()
+    assert (limiter.waits, limiter.wait_seconds) == (1, 1.0)
+
+
+def test_max_in_flight(clock):
+    limiter = teamcitycli.RateLimiter(max_in_flight=2)
+    first, _ = limiter.try_acquire()
+    second, _ = limiter.try_acquire()
+    assert sorted([first, second]) == [0, 1]
+    assert limiter.try_acquire() == (None, limiter.poll_interval)
+    limiter.release(first)
+    assert limiter.try_acquire() == (first, 0)
+
+
+def test_slot_released_when_rate_check_fails(clock):
+    limiter = teamcitycli.RateLimiter(rate=1, max_in_flight=1)
+    slot, _ = limiter.try_acquire()
+    limiter.release(slot)
+    assert limiter.try_acquire() == (None, 1)
+    assert limiter.free_slots == [0]
+    clock.now += 1
+    assert limiter.try_acquire() == (0, 0)
+
+
+def test_shared_slots(clock, shared_path):
+    first = teamcitycli.RateLimiter(max_in_flight=1, shared_path=shared_path)
+    second = teamcitycli.RateLimiter(max_in_flight=1, shared_path=shared_path)
+    try:
+        slot, _ = first.try_acquire()
+        assert second.try_acquire() == (None, second.poll_interval)
+        first.release(slot)
+        assert second.try_acquire() == (0, 0)
+    finally:
+        first.close()
+        second.close()
+
+
+def test_shared_bucket(clock, shared_path):
+    first = teamcitycli.RateLimiter(rate=1, shared_path=shared_path)
+    second = teamcitycli.RateLimiter(rate=1, shared_path=shared_path)
+    try:
+        assert first.try_acquire() == (None, 0)
+        assert second.try_acquire() == (None, 1)
+        clock.now += 1
+        assert second.try_acquire() == (None, 0)
+        assert first.try_acquire() == (None, 1)
+    finally:
+        first.close()
+        second.close()
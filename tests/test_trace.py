@@ -0,0 +1,57 @@
+import socket
+import threading
+
+import pytest
+import requests
+
+import teamcitycli
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+
+@pytest.fixture
+def server():
+    # Only on the second of the addresses that the host resolves to
+    server = HTTPServer(('127.0.0.2', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_traced_connections_try_each_address(server, monkeypatch):
+    port = server.server_address[1]
+    getaddrinfo = socket.getaddrinfo
+
+    def fake_getaddrinfo(host, *args, **kwargs):
+        if host != 'teamcity.test':
+            return getaddrinfo(host, *args, **kwargs)
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, '',
+                 (address, port)) for address in ('127.0.0.1', '127.0.0.2')]
+    monkeypatch.setattr(socket, 'getaddrinfo', fake_getaddrinfo)
+
+    session = teamcitycli.TeamCitySession(trace=True, retries=0)
+    try:
+        response = session.send(requests.Request(
+            'GET', 'http://teamcity.test:%d/' % port).prepare())
+    finally:
+        session.close()
+    assert response.content == b'ok'
+    trace = session.traces[-1]
+    assert trace.dns is not None
@@ -0,0 +1,41 @@
+import contextlib
+
+import pytest
+
+import teamcitycli
+
+
+class FakeSession(object):
+    @contextlib.contextmanager
+    def refreshing(self):
+        yield
+
+
+class FakeClient(object):
+    """Has build 1 finish on its second poll; build 2 was deleted"""
+
+    def __init__(self):
+        self.session = FakeSession()
+        self.polls = 0
+
+    def get_queued_build_by_build_id(self, build_id):
+        if build_id == 2:
+            raise ValueError('No build found')
+        self.polls += 1
+        return {'id': build_id,
+                'state': 'finished' if self.polls > 1 else 'queued'}
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(teamcitycli.time, 'sleep', lambda seconds: None)
+
+
+def test_builds_that_cant_be_polled_given_up_on(capsys):
+    done, errors = teamcitycli.wait_for_builds(
+        FakeClient(), [1, 2], ('finished',))
+    assert list(done) == [1]
+    assert list(errors) == [2]
+    assert str(errors[2]) == 'No build found'
+    assert capsys.readouterr().err.count(
+        'ERROR: build 2: ') == teamcitycli.max_poll_errors